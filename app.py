@@ -1,6 +1,10 @@
 import datetime
+import threading
+import time
+from collections import OrderedDict
 import streamlit as st
 import backend as be
+import numpy as np
 import pandas as pd
 
 RAW_BEHAVIOURAL_DATA = 'raw_behavioural_data'
@@ -8,57 +12,421 @@ STATISTICS = 'statistics'
 BOUTS_DATA = 'bouts_data'
 BOUT_STATISTICS = 'bout_statistics'
 LOCATION_STATISTICS = 'location_statistics'
+INTERBOUT_STATISTICS = 'interbout_statistics'
+TIME_BUDGET = 'time_budget'
 ALL_SUBJECTS = "All Subjects"
 OUTLIERS = 'outliers'
-DATA_TYPES = [RAW_BEHAVIOURAL_DATA, STATISTICS, BOUTS_DATA, BOUT_STATISTICS, LOCATION_STATISTICS, OUTLIERS]
+UNMATCHED_EVENTS = 'unmatched_events'
+PAIR_SYNCHRONY = 'pair_synchrony'
+GROUP_SYNCHRONY = 'group_synchrony'
+GAP_SENSITIVITY = 'gap_sensitivity'
+SENSITIVITY_MEASURES = ['Bouts', 'Mean bout duration (s)', 'Mixed proportion']
+INPUT_CACHE_DIR = '.input_cache'
+RESULT_CACHE_SIZE = 8
+OBSERVATION_STORE = 'observation_store'
+PIPELINE_JOB = 'pipeline_job'
+# (file id, size) -> content hash of each upload in the session
+FILE_HASHES = 'file_hashes'
+# seconds between reruns while the pipeline is running in the background
+POLL_INTERVAL = 0.5
+EXPORT = 'export'
+# tables with a row per event, which are shown a page at a time
+PAGED_DATA_TYPES = ['raw_behavioural_data', 'outliers']
+PAGE_SIZES = [100, 500, 1000]
+# label -> (backend format, file name, mime type)
+EXPORT_FORMATS = {
+    'Excel workbook': ('xlsx', 'behavioural_output.xlsx', 
+                       'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Parquet files (zip)': ('parquet', 'behavioural_output_parquet.zip', 'application/zip'),
+    'CSV files (zip)': ('csv', 'behavioural_output_csv.zip', 'application/zip'),
+}
+
+class ResultCache:
+    '''
+    Keeps the pipeline results for the most recently used
+    uploads, keyed by the files' content hashes and the 
+    pipeline parameters. The least recently used entry is 
+    dropped once there are more than `max_entries`.
+    '''
+    def __init__(self, max_entries=RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def put(self, key, results):
+        with self._lock:
+            self._results[key] = results
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._results.clear()
+            else:
+                self._results.pop(key, None)
+
+class ResultTables:
+    '''
+    The pipeline results combined into one table per data type,
+    indexed by subject, as be.combine_subject_tables lays them 
+    out. Each table is built the first time it's 
+    asked for and then kept, so selecting subjects is a lookup.
+    `combined` are tables that are already combined, such as the 
+    shared frames from be.compact_results, which the subjects' 
+    tables are views into. The tables are shared through the 
+    result cache, so don't change them in place.
+    '''
+    def __init__(self, results, memory_report=None, combined=None):
+        self.results = results
+        # bytes of each event table before and after be.compact_results, if it was run
+        self.memory_report = memory_report
+        self.subjects = list(results)
+        self._tables = dict(combined or {})
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get_table(self, data_type):
+        with self._lock:
+            if data_type not in self._tables:
+                self._tables[data_type] = be.combine_subject_tables(self.results, data_type)
+            return self._tables[data_type]
+
+    def get_synchrony(self):
+        # synchrony is between subjects, so it's worked out from every subject's events together
+        raw_data = self.get_table(RAW_BEHAVIOURAL_DATA).reset_index()
+        with self._lock:
+            if PAIR_SYNCHRONY not in self._tables:
+                self._tables[PAIR_SYNCHRONY], self._tables[GROUP_SYNCHRONY] = be.get_synchrony(raw_data)
+            return self._tables[PAIR_SYNCHRONY], self._tables[GROUP_SYNCHRONY]
+
+    def get_gap_sensitivity(self):
+        raw_data = self.get_table(RAW_BEHAVIOURAL_DATA).reset_index()
+        with self._lock:
+            if GAP_SENSITIVITY not in self._tables:
+                self._tables[GAP_SENSITIVITY] = be.get_gap_sensitivity(raw_data)
+            return self._tables[GAP_SENSITIVITY]
+
+    def get_rows(self, subjects, data_type):
+        table = self.get_table(data_type)
+        if ALL_SUBJECTS in subjects:
+            return table
+        return table[table.index.isin(subjects)]
+
+    def get_index(self, data_type):
+        table = self.get_table(data_type)
+        with self._lock:
+            if data_type not in self._indexes:
+                self._indexes[data_type] = be.TableIndex(table)
+            return self._indexes[data_type]
+
+    def find_rows(self, data_type, subjects, behaviours=(), dates=(), time_range=None):
+        filters = {'Subject': [] if ALL_SUBJECTS in subjects else subjects, 
+                   'Observation date': dates, 'Behavior': behaviours}
+        return self.get_index(data_type).find_rows(filters, time_range)
+
+    def get_page(self, data_type, rows, page, page_size, columns=None):
+        # only this slice is copied out of the table and sent to the browser
+        page_rows = self.get_table(data_type).iloc[rows[page * page_size:(page + 1) * page_size]]
+        return page_rows if columns is None else page_rows[columns]
+
+class PipelineJob:
+    '''
+    Runs the pipeline for one upload on a background thread, then
+    builds each subject's tables in turn, so they can be shown as
+    soon as they're ready. Only the tables of the sections that are
+    switched on are built; lazy results build the rest when they're
+    first shown. The thread never calls Streamlit; the script checks
+    on the job each time it reruns. A cancelled job stops before its
+    next observation or subject.
+    '''
+    def __init__(self, data_manager, previous=None, tables=()):
+        self.data_manager = data_manager
+        self.cache_key = data_manager.cache_key
+        self.previous = previous
+        self.recorder = be.StageRecorder(trace_memory=data_manager.trace_memory)
+        self.results = None
+        self.subjects = []
+        self.ready = []
+        # (done, total) observations of the observation store's update
+        self.observations = (0, 0)
+        self.tables = None
+        self.error = None
+        self._pending = []
+        self._priority = []
+        self._wanted = list(tables)
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait(self):
+        self._thread.join()
+
+    def is_done(self):
+        return self._finished.is_set()
+
+    def prioritise(self, subjects):
+        # the selected subjects are built next, in the order they were waiting in
+        with self._lock:
+            self._priority = list(subjects)
+            self._pending.sort(key=lambda subject: subject not in self._priority)
+
+    def request_tables(self, tables):
+        # the subjects still waiting get these tables built; the ready ones build them when they're shown
+        with self._lock:
+            self._wanted = list(tables)
+
+    def get_progress(self):
+        with self._lock:
+            return len(self.ready), len(self.subjects)
+
+    def get_observation_progress(self):
+        with self._lock:
+            return self.observations
+
+    def _set_observation_progress(self, done, total):
+        with self._lock:
+            self.observations = (done, total)
+
+    def get_ready_results(self):
+        with self._lock:
+            return {subject: self.results[subject] for subject in self.ready}
+
+    def _run(self):
+        if self.previous is not None:
+            # the observation store can't be updated by two jobs at once
+            self.previous.wait()
+            self.previous = None
+        try:
+            with be.instrumented(self.recorder):
+                self._build_tables()
+        except Exception as error:
+            self.error = error
+        finally:
+            self._finished.set()
+
+    def _build_tables(self):
+        results = self.data_manager._load_data(self._set_observation_progress, self._cancelled)
+        if results is None or self._cancelled.is_set():
+            return
+        with self._lock:
+            self.results = results
+            self.subjects = list(results)
+            self._pending = sorted(results, key=lambda subject: subject not in self._priority)
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+                subject = self._pending.pop(0)
+                tables = list(self._wanted)
+            if self._cancelled.is_set():
+                return
+            for table in tables:
+                # looking up a lazy table builds it
+                results[subject][table]
+            with self._lock:
+                self.ready.append(subject)
+        self.tables = self.data_manager._make_tables(results)
+        if self.data_manager.result_cache is not None:
+            self.data_manager.result_cache.put(self.cache_key, self.tables)
+
+@st.cache_resource
+def get_result_cache():
+    # shared between reruns and sessions, since the keys are content hashes
+    return ResultCache()
+
+def get_observation_store(gap=be.DEFAULT_GAP, min_duration=be.DEFAULT_MIN_DURATION,
+                          std_deviation_multiplier=be.DEFAULT_STD_DEVIATION_MULTIPLIER, bin_width=be.DEFAULT_BIN_WIDTH):
+    # one per session, so each user's uploads only process their new observations
+    store = st.session_state.get(OBSERVATION_STORE)
+    if store is None or (store.gap, store.min_duration, store.std_deviation_multiplier, store.bin_width) != (
+            gap, min_duration, std_deviation_multiplier, bin_width):
+        store = be.ObservationStore(gap, min_duration, std_deviation_multiplier, bin_width)
+        st.session_state[OBSERVATION_STORE] = store
+    return store
+
+DATA_TYPES = [RAW_BEHAVIOURAL_DATA, STATISTICS, BOUTS_DATA, BOUT_STATISTICS, LOCATION_STATISTICS, 
+              INTERBOUT_STATISTICS, TIME_BUDGET, OUTLIERS, UNMATCHED_EVENTS]
 
 class DataManager:
-    def __init__(self):
+    def __init__(self, workers=None, cache_dir=None, engine=None, result_cache=None, observation_store=None,
+                 gap=be.DEFAULT_GAP, min_duration=be.DEFAULT_MIN_DURATION, 
+                 std_deviation_multiplier=be.DEFAULT_STD_DEVIATION_MULTIPLIER, lazy=True, 
+                 bin_width=be.DEFAULT_BIN_WIDTH, compact=False, file_hashes=None):
         self.data_files = None
         self.data = None
+        self.tables = None
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.engine = engine
+        self.result_cache = result_cache
+        self.observation_store = observation_store
+        self.gap = gap
+        self.min_duration = min_duration
+        self.std_deviation_multiplier = std_deviation_multiplier
+        self.bin_width = bin_width
+        # only find the bouts up front, and build each table when it's first shown
+        self.lazy = lazy
+        # keep each subject's events as views into one frame of categoricals and float32s
+        self.compact = compact
+        # content hashes of uploads seen before, so they aren't read and hashed again on every rerun
+        self.file_hashes = file_hashes
+        self.trace_memory = False
+        self.recorder = None
+        self.cache_key = None
+        self.job = None
 
-    def load_data(self, data_files):
+    def start_loading(self, data_files, job=None, wanted_tables=()):
+        '''
+        Loads the results for `data_files` from the result cache, or 
+        if they aren't cached, leaves the pipeline running in a 
+        PipelineJob, and only the subjects that are ready so far are
+        shown. `job` is the one from the last rerun: it's carried on 
+        with if it's for the same files and parameters, and cancelled
+        if not. A new job builds the `wanted_tables` of each subject.
+        Returns the current job, which has an `error` if it failed.
+        '''
         self.data_files = data_files
-        self.data = self._load_data()
+        self.recorder = None
+        self.cache_key = self._get_cache_key()
+        if job is None or job.cache_key != self.cache_key:
+            if job is not None:
+                job.cancel()
+            tables = self.result_cache.get(self.cache_key) if self.result_cache is not None else None
+            if tables is not None:
+                self.job = None
+                self._use_tables(tables)
+                return None
+            job = PipelineJob(self, previous=job, tables=wanted_tables)
+            job.start()
 
-    def _load_data(self):
-        dfs = be.import_input_files(self.data_files)
-        data = self._run_and_concatenate(dfs) if dfs else None
-        return data
+        self.job = job
+        if not job.is_done():
+            self._use_tables(ResultTables(job.get_ready_results()))
+            return job
+        if job.error is not None:
+            # a failed job isn't carried on with, so the next rerun starts again
+            self.job = None
+            self._use_tables(None)
+            return job
+        self.recorder = job.recorder
+        self._use_tables(job.tables)
+        return job
 
-    @staticmethod
-    def _run_and_concatenate(dfs):
-        all_data = pd.concat(dfs.values())
-        results = be.run_pipeline(all_data)
+    def is_loading(self):
+        return self.job is not None and not self.job.is_done()
+
+    def _use_tables(self, tables):
+        self.tables = tables
+        self.data = tables.results if tables is not None else None
+
+    def _make_tables(self, data):
+        if data is None:
+            return None
+        if not self.compact:
+            return ResultTables(data)
+        data, combined, memory_report = be.run_stage('compact_results', be.compact_results, data)
+        return ResultTables(data, memory_report, combined)
+
+    def _get_cache_key(self):
+        file_hashes = tuple(self._hash_file(file) for file in self.data_files)
+        return (file_hashes, self.gap, self.min_duration, self.std_deviation_multiplier, self.bin_width, 
+                self.compact)
+
+    def _hash_file(self, file):
+        # an upload keeps its file id until it's removed, so it's only read and hashed the first time
+        key = (file.file_id, file.size) if hasattr(file, 'file_id') else None
+        if key is None or self.file_hashes is None:
+            return be.hash_input_file(be.read_input_file(file))
+        if key not in self.file_hashes:
+            self.file_hashes[key] = be.hash_input_file(be.read_input_file(file))
+        return self.file_hashes[key]
+
+    def _load_data(self, progress=None, cancelled=None):
+        # `progress` and `cancelled` are handed on to the observation store (see ObservationStore.update)
+        dfs = be.import_input_files(self.data_files, engine=self.engine, cache_dir=self.cache_dir)
+        if not dfs or (cancelled is not None and cancelled.is_set()):
+            return None
+        return self._run_and_concatenate(dfs, progress, cancelled)
+
+    def _run_and_concatenate(self, dfs, progress=None, cancelled=None):
+        all_data = be.concat_input_tables(dfs)
+        if self.observation_store is not None:
+            self.observation_store.update(all_data, progress, cancelled)
+            if cancelled is not None and cancelled.is_set():
+                # the store wasn't brought fully up to date, so its results would be missing observations
+                return None
+            return self.observation_store.get_results(lazy=self.lazy)
+
+        results = be.run_pipeline(all_data, grouped=True, workers=self.workers, gap=self.gap,
+                                  min_duration=self.min_duration,
+                                  std_deviation_multiplier=self.std_deviation_multiplier, lazy=self.lazy,
+                                  bin_width=self.bin_width)
         return results
 
     def get_subjects(self):
-        return [ALL_SUBJECTS] + list(self.data.keys()) if self.data else []
+        # while the pipeline's running, subjects can be picked before their tables are ready
+        if self.is_loading():
+            return [ALL_SUBJECTS] + self.job.subjects if self.job.subjects else []
+        return [ALL_SUBJECTS] + self.tables.subjects if self.data else []
 
     def get_data(self, subject, data_type):
-        if subject == ALL_SUBJECTS:
-            return self._get_all_subjects_data(data_type)
-        else:
-            return self._get_single_subject_data(subject, data_type)
-
-    def _get_all_subjects_data(self, data_type):
-        all_dfs = []
-        for subject, results in self.data.items():
-            data = results[data_type]
-            data['Subject'] = subject
-            data.sort_index(axis=1, inplace=True)
-            all_dfs.append(data)
-
-        all_data_df = pd.concat(all_dfs)
-        all_data_df.fillna(0, inplace=True)
-        return all_data_df
-
-    def _get_single_subject_data(self, subject, data_type):
-        data = self.data[subject][data_type]
-        data['Subject'] = subject
-        data.fillna(0, inplace=True)
-        data.sort_index(axis=1, inplace=True)
-        return data
+        return self.get_data_for_subjects([subject], data_type)
+
+    def get_data_for_subjects(self, subjects, data_type):
+        if not self.tables.subjects:
+            # no subject is ready yet
+            return pd.DataFrame()
+        return self.tables.get_rows(subjects, data_type)
+
+    def get_index(self, data_type):
+        return self.tables.get_index(data_type) if self.tables.subjects else None
+
+    def get_columns(self, data_type):
+        return list(self.tables.get_table(data_type).columns)
+
+    def find_rows(self, subjects, data_type, behaviours=(), dates=(), time_range=None):
+        return self.tables.find_rows(data_type, subjects, behaviours, dates, time_range)
+
+    def get_page(self, data_type, rows, page, page_size, columns=None):
+        return self.tables.get_page(data_type, rows, page, page_size, columns)
+
+    def get_synchrony(self, subjects):
+        pairs, groups = self.tables.get_synchrony()
+        if ALL_SUBJECTS in subjects:
+            return pairs, groups
+        return pairs[pairs['Subject A'].isin(subjects) | pairs['Subject B'].isin(subjects)], groups
+
+    def get_gap_sensitivity(self, subjects):
+        sweep = self.tables.get_gap_sensitivity()
+        if ALL_SUBJECTS in subjects:
+            return sweep
+        return sweep[sweep['Subject'].isin(subjects)]
+
+    def export(self, file_format):
+        # one table per data type, with every subject in it
+        tables = {}
+        for data_type in DATA_TYPES:
+            tables[data_type] = self.tables.get_table(data_type).reset_index()
+        tables[PAIR_SYNCHRONY], tables[GROUP_SYNCHRONY] = self.tables.get_synchrony()
+        if file_format == 'xlsx':
+            return be.write_to_excel(tables)
+        return be.write_to_zip(tables, file_format)
 
 class UIManager:
     def __init__(self, data_manager):
@@ -72,32 +440,159 @@ class UIManager:
         st.write("This pipeline takes in .csv or .tsv files and outputs a csv file with behavioural analysis data and statistics.")
 
         data_files = st.file_uploader("Upload your data files", type=['csv', 'tsv'], accept_multiple_files=True)
-        if data_files:
-            self.data_manager.load_data(data_files)
-            subjects = self.data_manager.get_subjects()
-            selected_subjects = st.multiselect('Select one or more subjects', subjects)
-
-            if selected_subjects: 
-                for data_type in DATA_TYPES:
-                    data_frames = []
-                    for selected_subject in selected_subjects:
-                        data = self.data_manager.get_data(selected_subject, data_type)
-                        data_frames.append(data)
-
-                    combined_data = pd.concat(data_frames, ignore_index=True)
-                    if 'Subject' in combined_data.columns:
-                        combined_data.set_index('Subject', inplace=True)
-                    else: 
-                        st.error('No subject column found in data. Please contact administrator')
-                    st.subheader(f"{data_type.title().replace('_', ' ')}")
-                    st.dataframe(combined_data)
+        if self.data_manager.result_cache is not None and st.sidebar.button('Clear cached results'):
+            self.data_manager.result_cache.invalidate()
+        self.data_manager.trace_memory = st.sidebar.checkbox('Trace memory use (slower)')
+        if not data_files:
+            # the upload was cleared, so there's nothing left to build
+            job = st.session_state.pop(PIPELINE_JOB, None)
+            if job is not None:
+                job.cancel()
+            return
+
+        # only the switched-on sections are built while the pipeline runs
+        shown_tables = [data_type for data_type in DATA_TYPES if st.session_state.get(f'show_{data_type}')]
+        job = self.data_manager.start_loading(data_files, st.session_state.get(PIPELINE_JOB), shown_tables)
+        if job is not None and job.error is not None:
+            st.session_state.pop(PIPELINE_JOB, None)
+            st.error(f'The files could not be processed: {job.error}')
+            return
+        st.session_state[PIPELINE_JOB] = job
+        loading = self.data_manager.is_loading()
+        if loading:
+            self.display_progress(job)
+        else:
+            self.display_timings()
+            self.display_memory()
+            self.display_export()
+        subjects = self.data_manager.get_subjects()
+        selected_subjects = st.multiselect('Select one or more subjects', subjects)
+        if loading and ALL_SUBJECTS not in selected_subjects:
+            job.prioritise(selected_subjects)
+        if loading:
+            job.request_tables(shown_tables)
+
+        if selected_subjects: 
+            for data_type in DATA_TYPES:
+                # tables are only computed for the sections that are switched on
+                if not st.toggle(data_type.title().replace('_', ' '), key=f'show_{data_type}'):
+                    continue
+                if data_type in PAGED_DATA_TYPES:
+                    self.display_paged_table(selected_subjects, data_type)
+                else:
+                    st.dataframe(self.data_manager.get_data_for_subjects(selected_subjects, data_type))
+            if loading:
+                # these are worked out across subjects, so they wait for all of them
+                st.info('Synchrony, gap sensitivity and the export are shown once every subject is ready.')
+            else:
+                if st.toggle('Synchrony between subjects', key='show_synchrony'):
+                    pairs, groups = self.data_manager.get_synchrony(selected_subjects)
+                    st.write('Seconds each pair of subjects spent doing the same behaviour at the same time')
+                    st.dataframe(pairs, hide_index=True)
+                    st.write('Share of the time anyone did each behaviour that two or more did it together')
+                    st.dataframe(groups, hide_index=True)
+                if st.toggle('Gap sensitivity', key='show_gap_sensitivity'):
+                    self.display_gap_sensitivity(selected_subjects)
+        else:
+            st.warning('No subjects selected. Select at least one subject to display data.')
+
+        if loading:
+            time.sleep(POLL_INTERVAL)
+            st.rerun()
+
+    def display_paged_table(self, selected_subjects, data_type):
+        index = self.data_manager.get_index(data_type)
+        if index is None:
+            st.dataframe(pd.DataFrame())
+            return
+        columns = self.data_manager.get_columns(data_type)
+        behaviour_column, date_column, column_column = st.columns(3)
+        behaviours = behaviour_column.multiselect('Behaviours', index.get_values('Behavior'), 
+                                                  key=f'{data_type}_behaviours')
+        dates = date_column.multiselect('Observation dates', index.get_values('Observation date'), 
+                                        key=f'{data_type}_dates')
+        shown_columns = column_column.multiselect('Columns', columns, default=columns, key=f'{data_type}_columns')
+        time_range = None
+        time_bounds = index.get_time_bounds()
+        if time_bounds is not None and time_bounds[1] > time_bounds[0]:
+            time_range = st.slider('Time (s)', *time_bounds, value=time_bounds, key=f'{data_type}_time_range')
+
+        rows = self.data_manager.find_rows(selected_subjects, data_type, behaviours, dates, time_range)
+        size_column, page_column = st.columns(2)
+        page_size = size_column.selectbox('Rows per page', PAGE_SIZES, key=f'{data_type}_page_size')
+        pages = max(1, -(-len(rows) // page_size))
+        # the label changes with the number of pages, which starts a filtered table back on page 1
+        page = page_column.number_input(f'Page (of {pages})', min_value=1, max_value=pages, 
+                                        key=f'{data_type}_page') - 1
+        st.dataframe(self.data_manager.get_page(data_type, rows, page, page_size, shown_columns))
+        first_row = page * page_size + 1 if len(rows) else 0
+        st.caption(f'Rows {first_row}-{min((page + 1) * page_size, len(rows))} of {len(rows)}')
+
+    def display_progress(self, job):
+        ready, total = job.get_progress()
+        if not total:
+            done, observations = job.get_observation_progress()
+            if not observations:
+                st.progress(0.0, text='Reading the files...')
             else:
-                st.warning('No subjects selected. Select at least one subject to display data.')
+                st.progress(done / observations, text=f'Found the bouts in {done} of {observations} observations')
+            return
+        st.progress(ready / total, text=f'Built the tables for {ready} of {total} subjects')
+
+    def display_gap_sensitivity(self, selected_subjects):
+        st.write(f'How the bouts would change with the gap used to merge them (currently {self.data_manager.gap} s)')
+        measure = st.selectbox('Measure', SENSITIVITY_MEASURES)
+        sweep = self.data_manager.get_gap_sensitivity(selected_subjects)
+        st.line_chart(sweep, x='Gap (s)', y=measure, color='Subject')
+
+    def display_timings(self):
+        recorder = self.data_manager.recorder
+        with st.expander('Pipeline timings'):
+            if recorder is None or not recorder.records:
+                st.write('These results came from the cache, so no pipeline stages ran.')
+                return
+            st.dataframe(recorder.summary())
+            stages = recorder.to_frame()
+            subject_stages = stages.dropna(subset=['subject'])
+            if not subject_stages.empty:
+                st.dataframe(subject_stages.pivot_table(index='subject', columns='stage', values='wall_time_s',
+                                                        aggfunc='sum', sort=False))
+            st.download_button('Download trace', recorder.to_trace(), file_name='pipeline_trace.json', 
+                               mime='application/json')
+
+    def display_memory(self):
+        tables = self.data_manager.tables
+        if tables is None or tables.memory_report is None:
+            return
+        with st.expander('Memory use'):
+            # the compacted tables are also the combined ones that are shown and exported, so they're all that's kept
+            st.write('Bytes taken up by each table across all subjects, before and after compacting it')
+            st.dataframe(tables.memory_report, hide_index=True)
+
+    def display_export(self):
+        if not self.data_manager.data:
+            return
+        label = st.selectbox('Export format', list(EXPORT_FORMATS))
+        file_format, file_name, mime = EXPORT_FORMATS[label]
+        # building the file can take a while, so it's only done on request and kept for this upload
+        export_key = (self.data_manager.cache_key, file_format)
+        export = st.session_state.get(EXPORT)
+        if export is None or export[0] != export_key:
+            if not st.button('Prepare export'):
+                return
+            with st.spinner('Writing export file...'):
+                export = (export_key, self.data_manager.export(file_format))
+            st.session_state[EXPORT] = export
+        st.download_button('Download output file', export[1], file_name=file_name, mime=mime)
 
 def main():
     st.set_page_config(page_title="Behavioural analysis pipeline", page_icon="🧠", initial_sidebar_state="auto", 
                            menu_items={"About": f'Built using Streamlit and deployed using Heroku. \nLast deployed on {datetime.datetime.now().strftime("%d/%m/%Y at %H:%M:%S UTC")}'})
-    data_manager = DataManager()
+    bin_width = st.sidebar.number_input('Time budget bin width (s)', min_value=1, value=be.DEFAULT_BIN_WIDTH, step=60)
+    compact = st.sidebar.checkbox('Compact tables in memory', value=True)
+    data_manager = DataManager(cache_dir=INPUT_CACHE_DIR, result_cache=get_result_cache(),
+                               observation_store=get_observation_store(bin_width=bin_width), bin_width=bin_width,
+                               compact=compact, file_hashes=st.session_state.setdefault(FILE_HASHES, {}))
     ui_manager = UIManager(data_manager)
     ui_manager.display()
 
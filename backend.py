@@ -1,6 +1,183 @@
+import hashlib
+import io
+import json
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
 import pandas as pd
-from intervaltree import Interval, IntervalTree
 import numpy as np
+import openpyxl
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+# note these are not related, they just both happen to be 3
+DEFAULT_GAP = 10
+DEFAULT_MIN_DURATION = 3
+DEFAULT_STD_DEVIATION_MULTIPLIER = 3
+# seconds in each bin of the time budget
+DEFAULT_BIN_WIDTH = 300
+# the gaps the bout statistics are worked out for in the sensitivity sweep
+SENSITIVITY_GAPS = list(range(0, 61))
+# a START is paired with the STOP of the same rank under these keys
+PAIRING_KEYS = ['Subject', 'Behavior', 'Modifier', 'Observation id', 'Observation date', 'Observation duration']
+# the groups the behaviour statistics are kept for
+BEHAVIOUR_KEYS = ['Subject', 'Behavior', 'Modifier']
+TIME_BUDGET_KEYS = ['Subject', 'Observation id', 'Observation date', 'Bin', 'Behavior', 'Modifier']
+# synchrony is measured between subjects doing the same behaviour in the same observation
+SYNCHRONY_KEYS = ['Observation id', 'Observation date', 'Behavior']
+# tables with a row per event, bout or bin, which compact_results shares between subjects
+EVENT_TABLES = ['raw_behavioural_data', 'bouts_data', 'time_budget', 'outliers', 'unmatched_events']
+# tables whose gaps are real: an unmatched event has no start or no stop,
+# and a subject with a single bout has no mean time between bouts
+UNFILLED_TABLES = ['unmatched_events', 'interbout_statistics']
+# a 0 in these would read as a real time or duration, so they're never filled in
+UNFILLED_COLUMNS = ['Time_start', 'Time_stop', 'Behaviour Duration (s)']
+# BORIS times are to the millisecond, so float32 is only used where it's well within one,
+# which rules out the times in a long observation but not the durations
+FLOAT32_TOLERANCE = 0.00005
+# the columns a TableIndex can filter on without scanning the table
+INDEX_KEYS = ['Subject', 'Observation date', 'Behavior']
+EXCEL_MAX_ROWS = 1_048_576
+EXPORT_CHUNK_SIZE = 10_000
+
+
+class StageRecorder:
+    '''
+    Collects the wall time, rows in and out and, if `trace_memory`
+    is set, the peak memory of every stage run while it is active
+    (see `instrumented`). Stages are recorded per subject or per
+    source file where the pipeline runs them that way.
+    tracemalloc has a single peak for the whole process, so before
+    a stage resets it, the peak so far is handed to every stage that
+    is still open. Each stage's peak then includes its nested stages
+    and, for stages on other threads, whatever ran alongside it.
+    '''
+    columns = ['stage', 'subject', 'source', 'start_s', 'wall_time_s', 
+               'rows_in', 'rows_out', 'peak_memory_bytes']
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._created = time.perf_counter()
+        # the highest traced memory seen by each stage that hasn't finished yet
+        self._open_peaks = []
+        self._memory_lock = threading.Lock()
+
+    def record(self, stage, function, args, kwargs, subject=None, source=None):
+        if self.trace_memory:
+            memory_before, open_peak = self._open_stage()
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            wall_time = time.perf_counter() - start
+            peak_memory = self._close_stage(open_peak) - memory_before if self.trace_memory else None
+
+        self.records.append({
+            'stage': stage,
+            'subject': subject,
+            'source': source,
+            'start_s': start - self._created,
+            'wall_time_s': wall_time,
+            'rows_in': next((len(arg) for arg in args if isinstance(arg, pd.DataFrame)), None),
+            'rows_out': count_rows(result),
+            'peak_memory_bytes': peak_memory,
+        })
+        return result
+
+    def _open_stage(self) -> tuple[int, list]:
+        with self._memory_lock:
+            self._update_open_peaks()
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+            open_peak = [memory_before]
+            self._open_peaks.append(open_peak)
+            return memory_before, open_peak
+
+    def _close_stage(self, open_peak: list) -> int:
+        with self._memory_lock:
+            self._update_open_peaks()
+            # by identity, since two open stages can have the same peak
+            del self._open_peaks[next(i for i, peak in enumerate(self._open_peaks) if peak is open_peak)]
+            return open_peak[0]
+
+    def _update_open_peaks(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_peak in self._open_peaks:
+            open_peak[0] = max(open_peak[0], peak)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records, columns=self.columns)
+
+    def summary(self) -> pd.DataFrame:
+        return self.to_frame().groupby('stage', sort=False).agg(
+            calls=('wall_time_s', 'count'), wall_time_s=('wall_time_s', 'sum'), 
+            rows_in=('rows_in', lambda rows: rows.sum(min_count=1)), 
+            rows_out=('rows_out', lambda rows: rows.sum(min_count=1)), 
+            peak_memory_bytes=('peak_memory_bytes', 'max'))
+
+    def to_trace(self) -> str:
+        '''
+        The records as a Chrome trace (open it in chrome://tracing or Perfetto).
+        '''
+        events = [{
+            'name': record['stage'],
+            'ph': 'X',
+            'ts': record['start_s'] * 1e6,
+            'dur': record['wall_time_s'] * 1e6,
+            'pid': 0,
+            'tid': 0,
+            'args': {key: record[key] for key in ['subject', 'source', 'rows_in', 'rows_out', 'peak_memory_bytes']
+                     if record[key] is not None},
+        } for record in self.records]
+        return json.dumps({'traceEvents': events}, default=str)
+
+    def write_trace(self, path):
+        Path(path).write_text(self.to_trace())
+
+
+_active_recorder = ContextVar('active_recorder', default=None)
+
+
+@contextmanager
+def instrumented(recorder: StageRecorder):
+    # a context variable, so concurrent Streamlit sessions each record their own stages
+    token = _active_recorder.set(recorder)
+    started_tracing = recorder.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield recorder
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _active_recorder.reset(token)
+
+
+def run_stage(stage, function, *args, subject=None, source=None, **kwargs):
+    '''
+    Calls `function`, recording it as a pipeline stage 
+    if a StageRecorder is active. Otherwise it's a plain call.
+    '''
+    recorder = _active_recorder.get()
+    if recorder is None:
+        return function(*args, **kwargs)
+    return recorder.record(stage, function, args, kwargs, subject, source)
+
+
+def count_rows(data):
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    if isinstance(data, tuple) and data:
+        return count_rows(data[0])
+    if isinstance(data, dict):
+        return len(data)
+    return None
 
 def separate_data_by_subject(data: pd.DataFrame) -> dict[str, pd.DataFrame]:
     print('Separating data by subject')
@@ -11,16 +188,14 @@ def separate_data_by_subject(data: pd.DataFrame) -> dict[str, pd.DataFrame]:
 
 
 def get_behaviour_modifiers(df: pd.DataFrame) -> pd.DataFrame:
-    df['Modifier'] = df[['Behavior']].apply(
-        lambda x: x['Behavior'].split("_", 1)[1] if len(x['Behavior'].split('_')) > 1 else '', axis=1)
-    df['Behavior'] = df[['Behavior']].apply(lambda x: x['Behavior'].split(
-        "_", 1)[0] if len(x['Behavior'].split('_')) > 1 else x['Behavior'], axis=1)
+    # a new frame, since `df` is often a slice of the whole dataset
+    behaviour_parts = df['Behavior'].str.partition('_')
+    return df.assign(Modifier=behaviour_parts[2], Behavior=behaviour_parts[0])
 
-    return df
-
-def get_bouts(df: pd.DataFrame, gap: float) -> pd.DataFrame:
+def get_bouts(df: pd.DataFrame, gap: float, min_duration: float = DEFAULT_MIN_DURATION,
+              std_deviation_multiplier: float = DEFAULT_STD_DEVIATION_MULTIPLIER) -> pd.DataFrame:
     '''
-    This function creates an interval tree,
+    This function merges the events of each date,
     so that multiple overlapping behaviours 
     can be considered part of the same bout.
     Bouts are merged if the time between them 
@@ -28,49 +203,126 @@ def get_bouts(df: pd.DataFrame, gap: float) -> pd.DataFrame:
     '''
     observation_dates = df['Observation date'].unique()
     all_bouts = pd.DataFrame()
+    all_outliers = pd.DataFrame()
+    all_unmatched = pd.DataFrame()
     bout_id = 1
 
     for date in observation_dates:
         df_date = df[df['Observation date'] == date]
         df_date = df_date.sort_values(['Time'], ascending=[True])
-        df_date, outliers = match_start_and_stop_for_behaviour(df_date)
-        raw_tree = IntervalTree(Interval(start, stop) for start, stop in zip(df_date['Time_start'], df_date['Time_stop']))
+        df_date, outliers, unmatched = match_start_and_stop_for_behaviour(df_date, min_duration, std_deviation_multiplier)
+        all_outliers = pd.concat([all_outliers, outliers])
+        all_unmatched = pd.concat([all_unmatched, unmatched], ignore_index=True)
+        if df_date.empty:
+            continue
+        _, _, bout_positions = merge_intervals(df_date['Time_start'].to_numpy(), df_date['Time_stop'].to_numpy(), gap)
+        df_date['bout_id'] = (bout_id + bout_positions).astype(float)
 
-        raw_tree.merge_overlaps()
-        intervals = [(i.begin, i.end) for i in raw_tree]
-        intervals.sort(key=lambda x: x[0]) #i.begin
+        df_date = identify_mixed_bouts(df_date)
+        bout_id = df_date['bout_id'].max() + 1
+        all_bouts = pd.concat([all_bouts, df_date])
 
-        merged = [intervals[0]]
-        for current in intervals:
-            previous = merged[-1]
-            if current[0] - previous[1] <= gap:
-                merged[-1] = (previous[0], max(previous[1], current[1]))
-            else:
-                merged.append(current)
+    if all_bouts.empty and not df.empty:
+        # no event was matched, but the table keeps its columns so the later stages still run
+        all_bouts = df_date.assign(bout_id=pd.Series(dtype=float), mixed_bout=pd.Series(dtype=bool))
+    return all_bouts, all_outliers, all_unmatched
 
-        merged_tree = IntervalTree(Interval(start, stop, bout_id + i) for i, (start, stop) in enumerate(merged))
+def get_bouts_for_all_subjects(df: pd.DataFrame, gap: float, min_duration: float = DEFAULT_MIN_DURATION,
+                               std_deviation_multiplier: float = DEFAULT_STD_DEVIATION_MULTIPLIER) -> pd.DataFrame:
+    '''
+    Whole-dataset version of get_bouts.
+    Every subject and observation date is matched and 
+    swept for bouts in one sorted pass, instead of
+    filtering the frame once per subject and date.
+    Bout ids are numbered per subject, in the order
+    the dates first appear, exactly as get_bouts does.
+    '''
+    date_order = df[['Subject', 'Observation date']].drop_duplicates()
+    date_order['date_rank'] = date_order.groupby('Subject', sort=False, observed=True).cumcount()
+    subject_order = pd.Series(np.arange(df['Subject'].nunique()), index=df['Subject'].unique())
+    df = df.sort_values(['Time'], ascending=[True], kind='stable')
 
-        intervals_df = pd.DataFrame([(interval.begin, interval.end, interval.data) for interval in merged_tree], 
-                                    columns=['Time_start', 'Time_stop', 'bout_id'])
-        df_date['bout_id'] = np.nan
+    # position of each START in its own subject and date, as get_bouts would index it
+    starts = df[df['Behavior type'] == 'START']
+    start_positions = starts.groupby(['Subject', 'Observation date'], sort=False, observed=True).cumcount().to_numpy()
+    merged_df, all_unmatched = pair_start_and_stop_events(df)
+    merged_df.index = start_positions[merged_df.index]
+    merged_df = merged_df.merge(date_order, on=['Subject', 'Observation date'], how='left').set_axis(merged_df.index)
+    merged_df['subject_rank'] = merged_df['Subject'].map(subject_order).astype(int)
+    merged_df['event_rank'] = merged_df.index
+    merged_df.sort_values(['subject_rank', 'date_rank', 'event_rank'], kind='stable', inplace=True)
+    merged_df.drop(columns=['date_rank', 'subject_rank', 'event_rank'], inplace=True)
 
-        for i, row in df_date.iterrows():
-            for j, interval_row in intervals_df.iterrows():
-                if interval_row['Time_start'] <= row['Time_start'] <= interval_row['Time_stop']:
-                    df_date.at[i, 'bout_id'] = interval_row['bout_id']
-                    break
+    all_bouts, all_outliers = filter_durations(merged_df, min_duration, std_deviation_multiplier, 
+                                               by=['Subject', 'Observation date'])
+    all_bouts = all_bouts.copy()
 
-        df_date = identify_mixed_bouts(df_date)
-        bout_id = df_date['bout_id'].max() + 1
-        all_bouts = pd.concat([all_bouts, df_date])
+    # bouts never span two dates, and are numbered from 1 for each subject
+    dates = all_bouts.groupby(['Subject', 'Observation date'], sort=False, observed=True).ngroup().to_numpy()
+    _, _, bout_positions = merge_intervals(all_bouts['Time_start'].to_numpy(), all_bouts['Time_stop'].to_numpy(), 
+                                           gap, groups=dates)
+    bout_positions = pd.Series(bout_positions, index=all_bouts.index)
+    first_bouts = bout_positions.groupby(all_bouts['Subject'], sort=False, observed=True).transform('min')
+    all_bouts['bout_id'] = (bout_positions - first_bouts + 1).astype(float)
+
+    bout_behaviour_counts = all_bouts.groupby(['Subject', 'bout_id'], observed=True)['Behavior'].transform('nunique')
+    all_bouts['mixed_bout'] = bout_behaviour_counts > 1
+
+    return all_bouts, all_outliers, all_unmatched
+
+def merge_intervals(starts: np.ndarray, stops: np.ndarray, gap: float, 
+                    groups: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Merges overlapping intervals, and intervals that are
+    at most `gap` apart, in one sweep over the intervals 
+    sorted by start. Intervals in different groups are
+    never merged.
+    Returns the start and stop of each merged interval, 
+    and the position of the merged interval each input 
+    interval ended up in.
+    '''
+    starts = np.asarray(starts, dtype=float)
+    stops = np.asarray(stops, dtype=float)
+    if groups is None:
+        groups = np.zeros(len(starts), dtype=np.int64)
+    if len(starts) == 0:
+        return starts, stops, np.empty(0, dtype=np.int64)
+
+    order = np.lexsort((starts, groups))
+    starts, stops, groups = starts[order], stops[order], np.asarray(groups)[order]
+
+    # running maximum of the stops within each group, taken over
+    # (group, rank of stop) keys so that it resets at every new group
+    stop_values, stop_ranks = np.unique(stops, return_inverse=True)
+    keys = groups.astype(np.int64) * len(stop_values) + stop_ranks
+    latest_stops = stop_values[np.maximum.accumulate(keys) % len(stop_values)]
 
-    return all_bouts, outliers
+    new_interval = np.ones(len(starts), dtype=bool)
+    new_interval[1:] = (groups[1:] != groups[:-1]) | (starts[1:] - latest_stops[:-1] > gap)
+    positions = np.cumsum(new_interval) - 1
+    first = np.flatnonzero(new_interval)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+
+    interval_positions = np.empty(len(starts), dtype=np.int64)
+    interval_positions[order] = positions
+    return starts[first], latest_stops[last], interval_positions
 
 def get_behaviour_data_for_each_subject(df: pd.DataFrame) -> pd.DataFrame:
-    basic_stats = df.groupby(['Subject', 'Behavior', 'Modifier']).agg({'Observation id': ['count'],
-                                                                       'Behaviour Duration (s)': ['sum', 'mean', 'var', 'std']})
-    basic_stats.columns = basic_stats.columns.map('_'.join)
-    basic_stats.reset_index(inplace=True)
+    aggregates = get_duration_aggregates(df, BEHAVIOUR_KEYS, 'Behaviour Duration (s)')
+    return get_behaviour_statistics_from_aggregates(aggregates)
+
+def get_behaviour_statistics_from_aggregates(aggregates: pd.DataFrame) -> pd.DataFrame:
+    behaviour_stats = get_statistics_from_aggregates(aggregates).set_index(BEHAVIOUR_KEYS)
+    return pivot_behaviour_statistics(pd.DataFrame({
+        'Observation id_count': behaviour_stats['count'],
+        'Behaviour Duration (s)_sum': behaviour_stats['sum'],
+        'Behaviour Duration (s)_mean': behaviour_stats['mean'],
+        'Behaviour Duration (s)_var': behaviour_stats['var'],
+        'Behaviour Duration (s)_std': behaviour_stats['std'],
+    }))
+
+def pivot_behaviour_statistics(basic_stats: pd.DataFrame) -> pd.DataFrame:
+    basic_stats = basic_stats.reset_index()
     # make a column for each behaviour-modifier pair
     basic_stats['behaviour_modifier'] = basic_stats[['Behavior', 'Modifier']].apply(
         lambda x: f'{x["Behavior"]}_{x["Modifier"]}', axis=1)
@@ -78,20 +330,18 @@ def get_behaviour_data_for_each_subject(df: pd.DataFrame) -> pd.DataFrame:
     basic_stats.set_index('Subject', inplace=True)
     basic_stats = basic_stats.pivot(columns='behaviour_modifier')
     basic_stats.columns = basic_stats.columns.map('_'.join)
-    basic_stats.reset_index(inplace=True)
     basic_stats.fillna(0, inplace=True)
-    basic_stats.set_index('Subject', inplace=True)
 
     return basic_stats
 
 def identify_mixed_bouts(df: pd.DataFrame) -> pd.DataFrame:
-    bout_behavior_counts = df.groupby('bout_id')['Behavior'].nunique()
+    bout_behavior_counts = df.groupby('bout_id', observed=True)['Behavior'].nunique()
     df['mixed_bout'] = df['bout_id'].map(bout_behavior_counts > 1)
     return df
 
 def generate_bouts_df(df: pd.DataFrame) -> pd.DataFrame:
     # generate a dataframe with the total time for each bout
-    bouts_df = df.groupby(['Subject', 'bout_id', 'mixed_bout'])[
+    bouts_df = df.groupby(['Subject', 'bout_id', 'mixed_bout'], observed=True)[
         'Behaviour Duration (s)'].agg('sum')
     bouts_df = bouts_df.reset_index()
     bouts_df.set_index('Subject', inplace=True)
@@ -100,81 +350,421 @@ def generate_bouts_df(df: pd.DataFrame) -> pd.DataFrame:
 def calculate_bout_stats(df: pd.DataFrame) -> pd.DataFrame:
     df.rename(columns={'Behaviour Duration (s)': 'Bout Duration (s)'}, inplace=True)
     df['mixed_bout'] = df['mixed_bout'].astype(str).replace({'True': 'Mixed', 'False': 'Non-mixed'})
-    
-    bout_stats = df.groupby(['mixed_bout', 'Subject'])['Bout Duration (s)'].agg(['count', 'sum', 'mean', 'std', 'var'])
-    bout_stats.columns = bout_stats.columns.map(''.join)
-    bout_stats.reset_index(inplace=True)
-    
-    all_bout_stats = df.groupby('Subject')['Bout Duration (s)'].agg(['count', 'sum', 'mean', 'std', 'var'])
-    all_bout_stats.columns = all_bout_stats.columns.map(''.join)
-    all_bout_stats.reset_index(inplace=True)
-    all_bout_stats['mixed_bout'] = 'All'
-    
+    aggregates = get_duration_aggregates(df.reset_index(), ['Subject', 'mixed_bout'], 'Bout Duration (s)')
+    return get_bout_statistics_from_aggregates(aggregates)
+
+def get_bout_statistics_from_aggregates(aggregates: pd.DataFrame) -> pd.DataFrame:
+    # the statistics over all of a subject's bouts come from merging its mixed and non-mixed aggregates
+    bout_stats = get_statistics_from_aggregates(aggregates)
+    all_bout_stats = get_statistics_from_aggregates(combine_duration_aggregates([aggregates], ['Subject']))
+    return pivot_bout_statistics(bout_stats, all_bout_stats)
+
+def pivot_bout_statistics(bout_stats: pd.DataFrame, all_bout_stats: pd.DataFrame) -> pd.DataFrame:
+    all_bout_stats = all_bout_stats.assign(mixed_bout='All')
     bout_stats = pd.concat([bout_stats, all_bout_stats], ignore_index=True)
     bout_stats_melt = bout_stats.melt(id_vars=['Subject', 'mixed_bout'], var_name='Stat')
-    bout_stats_pivot = bout_stats_melt.pivot_table(index='Subject', columns=['mixed_bout', 'Stat'], values='value')
+    bout_stats_pivot = bout_stats_melt.pivot_table(index='Subject', columns=['mixed_bout', 'Stat'], values='value', observed=True)
     bout_stats_pivot.columns = ['_'.join(col).lower() for col in bout_stats_pivot.columns]
 
-    total_bouts = bout_stats_pivot['all_count']
+    # a subject with no bouts has no columns at all
+    total_bouts = bout_stats_pivot.get('all_count', np.nan)
     mixed_bouts = bout_stats_pivot.get('mixed_count', 0) 
     bout_stats_pivot['mixed_proportion'] = mixed_bouts / total_bouts
     
     return bout_stats_pivot
 
 def get_time_doing_behaviour(df: pd.DataFrame) -> pd.DataFrame:
-    time_df = df.groupby(['Subject', 'Behavior', 'Modifier'])[
-        'Behaviour Duration (s)'].agg('sum')
-    time_df = time_df.reset_index()
-    time_df.rename(columns={'Behaviour Duration (s)': 'total time'}, inplace=True)
+    aggregates = get_duration_aggregates(df, BEHAVIOUR_KEYS, 'Behaviour Duration (s)')
+    return get_time_doing_behaviour_from_aggregates(aggregates)
+
+def get_time_doing_behaviour_from_aggregates(aggregates: pd.DataFrame) -> pd.DataFrame:
+    time_df = aggregates[BEHAVIOUR_KEYS + ['sum']].rename(columns={'sum': 'total time'})
+    return pivot_time_doing_behaviour(time_df)
+
+def pivot_time_doing_behaviour(time_df: pd.DataFrame) -> pd.DataFrame:
     # pivot to get the total time for each behaviour and the proportion of time spent doing each modifier
     pivot_df = time_df.pivot_table(index=['Subject', 'Behavior'], columns=[
-        'Modifier'], values='total time', aggfunc='sum')
+        'Modifier'], values='total time', aggfunc='sum', observed=True)
     pivot_df = pivot_df.div(pivot_df.sum(axis=1), axis=0)
-    pivot_df = pivot_df.reset_index()
     pivot_df.fillna(0, inplace=True)
+    pivot_df = pivot_df.reset_index()
     pivot_df.set_index('Subject', inplace=True)
 
 
     return pivot_df
 
+def get_interbout_statistics(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Statistics of the time between consecutive bouts, 
+    across all behaviours, for each subject. The coefficient 
+    of variation (cv) is the standard deviation over the mean.
+    '''
+    return get_interbout_statistics_from_aggregates(get_interbout_aggregates(df))
+
+def get_interbout_aggregates(df: pd.DataFrame) -> pd.DataFrame:
+    intervals = get_interbout_intervals(df)
+    aggregates = get_duration_aggregates(intervals, ['Subject'], 'Interbout Duration (s)')
+    # subjects with a single bout have no intervals, but still get a row
+    subjects = pd.Index(df['Subject'].unique(), name='Subject')
+    return aggregates.set_index('Subject').reindex(subjects, fill_value=0).reset_index()
+
+def get_interbout_intervals(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    The time from the end of each bout to the start of the
+    next one on the same date. Bouts never span two dates, 
+    so there's no interval from one date to the next.
+    '''
+    bouts = df.groupby(['Subject', 'Observation date', 'bout_id'], observed=True).agg(
+        bout_start=('Time_start', 'min'), bout_stop=('Time_stop', 'max')).reset_index()
+    subjects = bouts['Subject'].to_numpy()
+    dates = bouts['Observation date'].to_numpy()
+    same_date = (subjects[1:] == subjects[:-1]) & (dates[1:] == dates[:-1])
+    gaps = bouts['bout_start'].to_numpy()[1:] - bouts['bout_stop'].to_numpy()[:-1]
+    return pd.DataFrame({
+        'Subject': bouts['Subject'].iloc[1:][same_date].to_numpy(),
+        'Observation date': dates[1:][same_date],
+        'Interbout Duration (s)': gaps[same_date],
+    })
+
+def get_interbout_statistics_from_aggregates(aggregates: pd.DataFrame) -> pd.DataFrame:
+    interbout_stats = get_statistics_from_aggregates(aggregates).set_index('Subject')
+    interbout_stats['cv'] = interbout_stats['std'] / interbout_stats['mean']
+    interbout_stats.columns = 'interbout_' + interbout_stats.columns
+    return interbout_stats
+
+def get_time_budget(df: pd.DataFrame, bin_width: float = DEFAULT_BIN_WIDTH) -> pd.DataFrame:
+    '''
+    Splits every event at the edges of fixed-width time bins 
+    of its observation, and adds up the seconds spent on each 
+    behaviour and modifier in each bin. Returns one row per
+    subject, observation, bin, behaviour and modifier with 
+    any time in it.
+    '''
+    starts = df['Time_start'].to_numpy(dtype=float)
+    stops = df['Time_stop'].to_numpy(dtype=float)
+    first_bins = np.floor(starts / bin_width).astype(np.int64)
+    # an event that stops exactly on a bin edge doesn't reach into the next bin
+    last_bins = np.maximum(np.ceil(stops / bin_width).astype(np.int64) - 1, first_bins)
+    bins_per_event = last_bins - first_bins + 1
+
+    # one piece for every bin each event touches
+    events = np.repeat(np.arange(len(df)), bins_per_event)
+    piece_offsets = np.arange(len(events)) - np.repeat(np.cumsum(bins_per_event) - bins_per_event, bins_per_event)
+    bins = first_bins[events] + piece_offsets
+    seconds = np.minimum(stops[events], (bins + 1) * bin_width) - np.maximum(starts[events], bins * bin_width)
+
+    pieces = df[['Subject', 'Observation id', 'Observation date', 'Behavior', 'Modifier', 
+                 'Observation duration']].take(events).assign(Bin=bins, seconds=seconds)
+    time_budget = pieces.groupby(TIME_BUDGET_KEYS, observed=True).agg(
+        observation_duration=('Observation duration', 'first'), seconds=('seconds', 'sum')).reset_index()
+
+    bin_starts = time_budget['Bin'] * bin_width
+    # the last bin of an observation is cut short by its end
+    bin_ends = np.minimum(bin_starts + bin_width, time_budget['observation_duration'].clip(lower=bin_starts))
+    time_budget.insert(3, 'Bin start (s)', bin_starts.astype(float))
+    time_budget.insert(4, 'Bin end (s)', bin_ends)
+    time_budget['Duration in bin (s)'] = time_budget.pop('seconds')
+    time_budget['Proportion of bin'] = time_budget['Duration in bin (s)'] / (bin_ends - bin_starts)
+    return time_budget.drop(columns=['Bin', 'observation_duration'])
+
+def get_synchrony(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Finds when subjects do the same behaviour at the same time
+    in an observation, from the matched events of all subjects.
+    Returns the seconds of overlap for each pair of subjects and
+    behaviour, and a synchrony index for each behaviour: the share 
+    of the time anyone does it that two or more do it together.
+    '''
+    intervals = get_subject_behaviour_intervals(df)
+    return get_pair_overlaps(intervals), get_group_synchrony(intervals)
+
+def get_subject_behaviour_intervals(df: pd.DataFrame) -> pd.DataFrame:
+    # each subject's overlapping events of a behaviour are merged first, so that no time is counted twice
+    keys = SYNCHRONY_KEYS + ['Subject']
+    groups = df.groupby(keys, observed=True).ngroup().to_numpy()
+    starts, stops, positions = merge_intervals(df['Time_start'].to_numpy(), df['Time_stop'].to_numpy(), 0, 
+                                               groups=groups)
+    first_events = np.empty(len(starts), dtype=np.int64)
+    first_events[positions] = np.arange(len(df))
+    intervals = df[keys].take(first_events).reset_index(drop=True)
+    intervals['Time_start'] = starts
+    intervals['Time_stop'] = stops
+    # sorted by start within each observation and behaviour, for the sweeps
+    behaviours = intervals.groupby(SYNCHRONY_KEYS, observed=True).ngroup().to_numpy()
+    order = np.lexsort((starts, behaviours))
+    return intervals.take(order).assign(behaviour_group=behaviours[order]).reset_index(drop=True)
+
+def get_pair_overlaps(intervals: pd.DataFrame) -> pd.DataFrame:
+    '''
+    A sweep-line join: every interval overlaps exactly the 
+    intervals of the same behaviour that start after it starts
+    and before it stops, which are found with a binary search, 
+    so the work grows with the number of overlaps, not pairs.
+    '''
+    starts = intervals['Time_start'].to_numpy()
+    stops = intervals['Time_stop'].to_numpy()
+    groups = intervals['behaviour_group'].to_numpy().astype(np.int64)
+    # search (group, time) keys, built from the ranks of the times so they compare exactly
+    times, ranks = np.unique(np.concatenate([starts, stops]), return_inverse=True)
+    start_keys = groups * len(times) + ranks[:len(starts)]
+    stop_keys = groups * len(times) + ranks[len(starts):]
+    overlap_ends = np.searchsorted(start_keys, stop_keys, side='left')
+
+    first = np.arange(len(starts))
+    overlap_counts = np.maximum(overlap_ends - first - 1, 0)
+    left = np.repeat(first, overlap_counts)
+    right = left + 1 + np.arange(len(left)) - np.repeat(np.cumsum(overlap_counts) - overlap_counts, overlap_counts)
+    subjects = intervals['Subject'].to_numpy()
+    other_subject = subjects[left] != subjects[right]
+    left, right = left[other_subject], right[other_subject]
+
+    pairs = intervals[SYNCHRONY_KEYS].take(left).reset_index(drop=True)
+    pairs['Subject A'] = np.where(subjects[left] < subjects[right], subjects[left], subjects[right])
+    pairs['Subject B'] = np.where(subjects[left] < subjects[right], subjects[right], subjects[left])
+    pairs['Overlap (s)'] = np.minimum(stops[left], stops[right]) - starts[right]
+    return pairs.groupby(SYNCHRONY_KEYS + ['Subject A', 'Subject B'], observed=True)['Overlap (s)'].sum().reset_index()
+
+def get_group_synchrony(intervals: pd.DataFrame) -> pd.DataFrame:
+    # a sweep over the starts (+1) and stops (-1), counting how many subjects are doing each behaviour
+    groups = intervals['behaviour_group'].to_numpy()
+    times = np.concatenate([intervals['Time_start'].to_numpy(), intervals['Time_stop'].to_numpy()])
+    changes = np.concatenate([np.ones(len(intervals), dtype=np.int64), -np.ones(len(intervals), dtype=np.int64)])
+    event_groups = np.concatenate([groups, groups])
+    # stops come before starts at the same time, so touching intervals don't count as together
+    order = np.lexsort((changes, times, event_groups))
+    times, changes, event_groups = times[order], changes[order], event_groups[order]
+    active = np.cumsum(changes)[:-1]
+    segments = np.where(event_groups[1:] == event_groups[:-1], np.diff(times), 0)
+    segment_groups = event_groups[:-1]
+
+    n_groups = groups.max() + 1 if len(groups) else 0
+    time_any = np.bincount(segment_groups, weights=segments * (active >= 1), minlength=n_groups)
+    time_shared = np.bincount(segment_groups, weights=segments * (active >= 2), minlength=n_groups)
+    subject_time = np.bincount(segment_groups, weights=segments * active, minlength=n_groups)
+
+    group_synchrony = intervals.drop_duplicates('behaviour_group')[SYNCHRONY_KEYS].reset_index(drop=True)
+    group_synchrony['Subjects'] = intervals.groupby('behaviour_group')['Subject'].nunique().to_numpy()
+    group_synchrony['Time any (s)'] = time_any
+    group_synchrony['Time together (s)'] = time_shared
+    group_synchrony['Synchrony index'] = time_shared / time_any
+    group_synchrony['Mean subjects at once'] = subject_time / time_any
+    return group_synchrony
+
+def get_gap_sensitivity(df: pd.DataFrame, gaps=SENSITIVITY_GAPS) -> pd.DataFrame:
+    '''
+    The bout count, mean bout duration and mixed-bout proportion
+    each subject would have for every gap in `gaps`, from one sort
+    of their matched events rather than a pipeline run per gap.
+    An event starts a new bout when its separation (start minus 
+    the latest stop so far on its date) is more than the gap, 
+    and separations don't depend on the gap, so every count is
+    a binary search over sorted separations.
+    '''
+    dates = df.groupby(['Subject', 'Observation date'], sort=False, observed=True).ngroup().to_numpy()
+    order = np.lexsort((df['Time_start'].to_numpy(), dates))
+    dates = dates[order]
+    starts = df['Time_start'].to_numpy(dtype=float)[order]
+    stops = df['Time_stop'].to_numpy(dtype=float)[order]
+    behaviours = df['Behavior'].to_numpy()[order]
+    subjects = df['Subject'].to_numpy()[order]
+
+    # running maximum of the stops within each date (see merge_intervals)
+    stop_values, stop_ranks = np.unique(stops, return_inverse=True)
+    latest_stops = stop_values[np.maximum.accumulate(dates.astype(np.int64) * len(stop_values) + stop_ranks) 
+                               % len(stop_values)]
+    first_of_date = np.ones(len(starts), dtype=bool)
+    first_of_date[1:] = dates[1:] != dates[:-1]
+    separations = np.full(len(starts), np.inf)
+    separations[1:] = starts[1:] - latest_stops[:-1]
+    separations[first_of_date] = np.inf
+
+    # a bout is mixed if the behaviour changes between two of its events that follow each other.
+    # The change at j is in the same bout as the event before it when its separation is within the gap,
+    # and is the bout's first change when the largest separation since the previous change isn't
+    changes = np.flatnonzero(~first_of_date & (behaviours != np.roll(behaviours, 1)))
+    since_previous_change = np.maximum.reduceat(separations[:changes[-1]], np.concatenate([[0], changes[:-1]])) \
+        if len(changes) else np.empty(0)
+    first_change_separations = np.maximum(separations[changes], since_previous_change)
+
+    gaps = np.asarray(gaps, dtype=float)
+    sweeps = []
+    for subject in pd.unique(subjects):
+        in_subject = subjects == subject
+        change_in_subject = subjects[changes] == subject
+        bouts = count_above(separations[in_subject], gaps)
+        mixed_bouts = (count_at_most(separations[changes][change_in_subject], gaps) 
+                       - count_at_most(first_change_separations[change_in_subject], gaps))
+        total_duration = (stops[in_subject] - starts[in_subject]).sum()
+        sweeps.append(pd.DataFrame({
+            'Subject': subject,
+            'Gap (s)': gaps,
+            'Bouts': bouts,
+            'Mean bout duration (s)': total_duration / bouts,
+            'Mixed bouts': mixed_bouts,
+            'Mixed proportion': mixed_bouts / bouts,
+        }))
+    return pd.concat(sweeps, ignore_index=True) if sweeps else pd.DataFrame()
+
+def count_above(values: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    return len(values) - np.searchsorted(np.sort(values), thresholds, side='right')
+
+def count_at_most(values: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    return np.searchsorted(np.sort(values), thresholds, side='right')
+
+def get_duration_aggregates(df: pd.DataFrame, by: list[str], column: str) -> pd.DataFrame:
+    '''
+    Summarises the durations in each group as a count, a sum and 
+    the sum of squared deviations from the group mean (m2). 
+    These can be merged across observations with 
+    combine_duration_aggregates, without keeping the events.
+    '''
+    # compacted durations are float32, but are added up in float64
+    aggregates = df[column].astype(float).groupby([df[key] for key in by], observed=True).agg(['count', 'sum', 'var'])
+    aggregates['m2'] = aggregates.pop('var').fillna(0) * (aggregates['count'] - 1)
+    return aggregates.reset_index()
+
+def combine_duration_aggregates(aggregates: list[pd.DataFrame], by: list[str]) -> pd.DataFrame:
+    # merges the m2 of each part using the shift of its mean from the combined mean (Chan et al.)
+    partials = pd.concat(aggregates, ignore_index=True)
+    grouped = partials.groupby(by, sort=False, observed=True)
+    combined_mean = grouped['sum'].transform('sum') / grouped['count'].transform('sum')
+    mean_shift = partials['sum'] / partials['count'] - combined_mean
+    partials['m2'] = partials['m2'] + partials['count'] * mean_shift ** 2
+    return partials.groupby(by, observed=True)[['count', 'sum', 'm2']].sum().reset_index()
+
+def get_statistics_from_aggregates(aggregates: pd.DataFrame) -> pd.DataFrame:
+    statistics = aggregates.drop(columns='m2')
+    statistics['mean'] = aggregates['sum'] / aggregates['count']
+    statistics['var'] = aggregates['m2'] / (aggregates['count'] - 1).where(aggregates['count'] > 1)
+    statistics['std'] = np.sqrt(statistics['var'])
+    return statistics
+
 def get_total_stereotyping_duration(df: pd.DataFrame) -> pd.DataFrame:
     pass
 
-def write_to_excel(df: pd.DataFrame) -> None:
-    pass
+def write_to_excel(tables: dict[str, pd.DataFrame]) -> bytes:
+    '''
+    Writes each table to its own sheet of an in-memory workbook.
+    The workbook is write-only, so rows are streamed into it a
+    chunk at a time instead of being kept as cells. A table with 
+    more rows than fit on one sheet carries on in numbered sheets.
+    '''
+    workbook = openpyxl.Workbook(write_only=True)
+    rows_per_sheet = EXCEL_MAX_ROWS - 1
+    for name, df in tables.items():
+        for part, first_row in enumerate(range(0, max(len(df), 1), rows_per_sheet)):
+            sheet = workbook.create_sheet(get_sheet_title(name, part))
+            sheet.append([str(column) for column in df.columns])
+            last_row = min(first_row + rows_per_sheet, len(df))
+            for chunk_start in range(first_row, last_row, EXPORT_CHUNK_SIZE):
+                chunk = df.iloc[chunk_start:min(chunk_start + EXPORT_CHUNK_SIZE, last_row)].astype(object)
+                # empty cells rather than NaN, which Excel can't read
+                for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+                    sheet.append(row)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+def get_sheet_title(name: str, part: int) -> str:
+    # sheet titles can be at most 31 characters long
+    return name[:31] if part == 0 else f'{name[:25]} ({part + 1})'
+
+def write_to_zip(tables: dict[str, pd.DataFrame], file_format: str = 'parquet') -> bytes:
+    '''
+    Writes each table to its own Parquet or CSV file
+    in an in-memory zip archive. 
+    Much faster than Excel for large raw event tables.
+    '''
+    output = io.BytesIO()
+    # Parquet files are already compressed
+    compression = zipfile.ZIP_STORED if file_format == 'parquet' else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(output, 'w', compression=compression) as archive:
+        for name, df in tables.items():
+            with archive.open(f'{name}.{file_format}', 'w') as file:
+                if file_format == 'parquet':
+                    df.to_parquet(file, index=False)
+                elif file_format == 'csv':
+                    with io.TextIOWrapper(file, encoding='utf-8', newline='') as text_file:
+                        df.to_csv(text_file, index=False)
+                else:
+                    raise ValueError(f'Unknown export format: {file_format}')
+    return output.getvalue()
+
+
+def match_start_and_stop_for_behaviour(df: pd.DataFrame, min_duration: float = DEFAULT_MIN_DURATION,
+                                       std_deviation_multiplier: float = DEFAULT_STD_DEVIATION_MULTIPLIER) -> pd.DataFrame:
+    merged_df, unmatched_df = pair_start_and_stop_events(df)
+    df_without_outliers, df_outliers = filter_durations(merged_df, min_duration, std_deviation_multiplier)
+    return df_without_outliers, df_outliers, unmatched_df
+
+
+def pair_start_and_stop_events(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Pairs the k-th START of each behaviour and modifier in an
+    observation with its k-th STOP. The events are sorted once,
+    by pairing key and time, and paired by their positions.
+    Returns the paired events, in the order of their STARTs,
+    and the events that couldn't be paired: STARTs without a STOP,
+    STOPs without a START, and pairs that stop before they start.
+    '''
+    is_start = (df['Behavior type'] == 'START').to_numpy()
+    is_stop = (df['Behavior type'] == 'STOP').to_numpy()
+    group = df.groupby(PAIRING_KEYS, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+    time = df['Time'].to_numpy(dtype=float)
+    order = np.lexsort((time, group))
+
+    start_positions, start_keys = get_pairing_keys(order[is_start[order]], group, len(df))
+    stop_positions, stop_keys = get_pairing_keys(order[is_stop[order]], group, len(df))
+    candidates = np.searchsorted(stop_keys, start_keys).clip(max=max(len(stop_keys) - 1, 0))
+    has_stop = (stop_keys[candidates] == start_keys) if len(stop_keys) else np.zeros(len(start_keys), dtype=bool)
+    has_start = np.isin(stop_keys, start_keys)
+
+    stop_time_at = np.full(len(df), np.nan)
+    stop_time_at[start_positions[has_stop]] = time[stop_positions[candidates[has_stop]]]
+
+    paired_df = df[is_start].drop(columns='Behavior type').rename(columns={'Time': 'Time_start'})
+    paired_df.index = np.arange(len(paired_df))
+    paired_df['Time_stop'] = stop_time_at[is_start]
+    paired_df['Behaviour Duration (s)'] = paired_df['Time_stop'] - paired_df['Time_start']
 
+    unpaired_stops = df[is_stop].iloc[np.sort(np.searchsorted(np.flatnonzero(is_stop), stop_positions[~has_start]))]
+    unpaired_stops = unpaired_stops.drop(columns='Behavior type').rename(columns={'Time': 'Time_stop'})
+    unpaired_stops.insert(paired_df.columns.get_loc('Time_start'), 'Time_start', np.nan)
+    problems = pd.Series(np.select([paired_df['Time_stop'].isna(), paired_df['Behaviour Duration (s)'] < 0],
+                                   ['no STOP', 'negative duration'], ''), index=paired_df.index)
+    unmatched_df = pd.concat([paired_df[problems != ''].assign(Problem=problems[problems != '']),
+                              unpaired_stops.assign(Problem='no START')], ignore_index=True)
 
-def match_start_and_stop_for_behaviour(df: pd.DataFrame) -> pd.DataFrame:
-    start_dataframe = df[df['Behavior type'] == 'START']
-    stop_dataframe = df[df['Behavior type'] == 'STOP']
+    return paired_df[problems == ''], unmatched_df
 
-    start_dataframe['start_id'] = start_dataframe.groupby(
-        ['Subject', 'Behavior', 'Observation id', 'Observation date',
-         'Observation duration']).cumcount()
-    stop_dataframe['stop_id'] = stop_dataframe.groupby(
-       ['Subject', 'Behavior', 'Observation id', 'Observation date',
-         'Observation duration']).cumcount()
 
-    merged_df = pd.merge(start_dataframe, stop_dataframe, how='left', left_on=[
-        'Subject', 'Behavior', 'Observation id', 'start_id', 'Modifier', 'Observation date', 'Observation duration'],
-        right_on=[
-            'Subject', 'Behavior', 'Observation id', 'stop_id', 'Modifier', 'Observation date', 'Observation duration'], 
-            suffixes=["_start", "_stop"])
+def get_pairing_keys(positions: np.ndarray, group: np.ndarray, n_events: int) -> tuple[np.ndarray, np.ndarray]:
+    # positions are sorted by group and time, so an event's rank in its group is 
+    # its distance from the group's first event; the key is unique per (group, rank)
+    event_groups = group[positions]
+    ranks = np.arange(len(positions)) - np.searchsorted(event_groups, event_groups, side='left')
+    return positions, event_groups.astype(np.int64) * (n_events + 1) + ranks
 
-    merged_df.drop(columns=['start_id', 'stop_id',
-                   'Behavior type_start', 'Behavior type_stop'], inplace=True)
 
-    merged_df['Behaviour Duration (s)'] = merged_df[['Time_stop', 'Time_start']].apply(
-        lambda x: x['Time_stop'] - x['Time_start'], axis=1)
-    # I don't like hardcoding this, but it will have to do for now
-    # TODO: make this a parameter
+def filter_durations(merged_df: pd.DataFrame, min_duration: float = DEFAULT_MIN_DURATION,
+                     std_deviation_multiplier: float = DEFAULT_STD_DEVIATION_MULTIPLIER,
+                     by: list[str] | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Drops events shorter than the minimum duration and 
+    splits off outliers more than a few standard deviations
+    from the mean duration. If `by` is given, the mean and
+    standard deviation are taken within each group.
+    '''
     # TODO: rearchitect things so this function is not multiple functions deep 
-    # note these two are not related, they just both happen to be 3
-    std_deviation_multiplier = 3
-    min_duration = 3
     merged_df = merged_df[merged_df['Behaviour Duration (s)'] >= min_duration]
-    mean = merged_df['Behaviour Duration (s)'].mean()
-    std_dev = merged_df['Behaviour Duration (s)'].std()
+    if by is None:
+        mean = merged_df['Behaviour Duration (s)'].mean()
+        std_dev = merged_df['Behaviour Duration (s)'].std()
+    else:
+        durations = merged_df.groupby(by, sort=False, observed=True)['Behaviour Duration (s)']
+        mean = durations.transform('mean')
+        std_dev = durations.transform('std')
     lower_bound = mean - std_deviation_multiplier * std_dev
     upper_bound = mean + std_deviation_multiplier * std_dev
     df_without_outliers = merged_df.loc[(merged_df['Behaviour Duration (s)'] >= lower_bound) & (merged_df['Behaviour Duration (s)'] <= upper_bound)]
@@ -183,43 +773,639 @@ def match_start_and_stop_for_behaviour(df: pd.DataFrame) -> pd.DataFrame:
     return df_without_outliers, df_outliers
 
 
-def import_input_files(data_files) ->  dict[str, pd.DataFrame]:
-    input_data_tables_dict= {}
-    columns_of_interest = ['Observation id',
-                           'Subject', 'Behavior',
-                           'Behavior type', 'Time', 
-                           'Observation date', 'Observation duration']
-    if data_files is not None:
-        for file in data_files:
-            file.seek(0)
-            print(f'Reading columns for file {file.name}')
-            input_data_tables_dict[file.name] = pd.read_csv(
-                file, delimiter='\t')
-            input_data_tables_dict[file.name].drop(columns=[col for col in input_data_tables_dict[file.name]
-                                                            if col not in columns_of_interest], inplace=True)
+def import_input_files(data_files, engine=None, cache_dir=None, workers=None) ->  dict[str, pd.DataFrame]:
+    '''
+    Reads only the columns the pipeline uses, with the repeated
+    text columns as categoricals. `engine` is passed to pd.read_csv
+    (e.g. 'pyarrow' for the faster parser). If `cache_dir` is given,
+    each parsed file is saved there as Parquet, named by the hash
+    of its contents, so the same export is only ever parsed once.
+    `data_files` can be uploaded files or paths. With `workers`, 
+    that many files are parsed at once, in threads.
+    '''
+    if data_files is None:
+        return {}
+    read_file = partial(import_input_file, engine=engine, cache_dir=cache_dir)
+    if workers is None or workers <= 1:
+        return dict(read_file(file) for file in data_files)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # each thread runs in a copy of this context, so its stages are still recorded
+        futures = [executor.submit(copy_context().run, read_file, file) for file in data_files]
+        return dict(future.result() for future in futures)
+
+
+def concat_input_tables(dfs: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Stacks the tables of import_input_files into one. Each file is 
+    parsed with its own categories, which pd.concat would turn back
+    into object columns, so every categorical column is given the 
+    union of the files' categories first.
+    '''
+    tables = list(dfs.values())
+    for column in tables[0].columns:
+        if not all(isinstance(table[column].dtype, pd.CategoricalDtype) for table in tables):
+            continue
+        categories = pd.api.types.union_categoricals([table[column] for table in tables], 
+                                                     sort_categories=True).categories
+        dtype = pd.CategoricalDtype(categories)
+        tables = [table.astype({column: dtype}) for table in tables]
+    return pd.concat(tables)
+
+
+def import_input_file(file, engine=None, cache_dir=None) -> tuple[str, pd.DataFrame]:
+    # in the order BORIS writes them, so every parser engine gives the same layout
+    columns_of_interest = ['Observation id', 'Observation date', 
+                           'Observation duration', 'Subject', 
+                           'Behavior', 'Behavior type', 'Time']
+    column_types = {'Observation id': 'category',
+                    'Observation date': 'str',
+                    'Observation duration': 'float64',
+                    'Subject': 'category',
+                    'Behavior': 'category',
+                    'Behavior type': 'category',
+                    'Time': 'float64'}
+    name = get_input_file_name(file)
+    content = read_input_file(file)
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f'{hash_input_file(content)}.parquet'
+        if cache_path.exists():
+            print(f'Loading cached columns for file {name}')
+            return name, run_stage('read_parquet', pd.read_parquet, cache_path, source=name)
+
+    print(f'Reading columns for file {name}')
+    input_data = run_stage('read_csv', pd.read_csv, io.BytesIO(content), delimiter='\t', 
+                           usecols=columns_of_interest, dtype=column_types, engine=engine, 
+                           source=name)
+    input_data = input_data[columns_of_interest]
+    if cache_dir is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        run_stage('write_parquet', input_data.to_parquet, cache_path, source=name)
+    return name, input_data
+
+
+def read_input_file(file) -> bytes:
+    if isinstance(file, (str, Path)):
+        return Path(file).read_bytes()
+    file.seek(0)
+    content = file.read()
+    file.seek(0)
+    return content
+
+
+def get_input_file_name(file) -> str:
+    return Path(file).name if isinstance(file, (str, Path)) else file.name
+
 
-    return input_data_tables_dict
+def hash_input_file(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
 
 
-def run_pipeline(df):
+def run_pipeline(df, grouped=False, workers=None, gap=DEFAULT_GAP, min_duration=DEFAULT_MIN_DURATION,
+                 std_deviation_multiplier=DEFAULT_STD_DEVIATION_MULTIPLIER, lazy=False, bin_width=DEFAULT_BIN_WIDTH):
+    '''
+    Returns the result tables for each subject. If `lazy` is set,
+    only the bouts are found up front, and each subject's tables
+    are computed when they are first looked up (see SubjectResults).
+    '''
+    if workers is not None and workers > 1:
+        # the workers' own stages aren't recorded, only the whole fan-out
+        return run_stage('run_pipeline_in_parallel', run_pipeline_in_parallel, df, workers, gap, 
+                         min_duration, std_deviation_multiplier, lazy, bin_width)
+    if grouped:
+        return run_pipeline_for_all_subjects(df, gap, min_duration, std_deviation_multiplier, lazy, bin_width)
 
-    data_by_subject = separate_data_by_subject(df)
+    data_by_subject = run_stage('separate_data_by_subject', separate_data_by_subject, df)
     results = {}
     for subject in data_by_subject:
-        subject_data = get_behaviour_modifiers(data_by_subject[subject])
-        subject_data, outliers = get_bouts(subject_data, 10)
-        stats = get_behaviour_data_for_each_subject(subject_data)
-        bouts_data = generate_bouts_df(subject_data)
-        bout_stats = calculate_bout_stats(bouts_data)
-        summary_df =  get_time_doing_behaviour(subject_data)
+        subject_data = run_stage('get_behaviour_modifiers', get_behaviour_modifiers, data_by_subject[subject], 
+                                 subject=subject)
+        subject_data, outliers, unmatched = run_stage('get_bouts', get_bouts, subject_data, gap, min_duration, 
+                                           std_deviation_multiplier, subject=subject)
+        # a subject with no matched events is kept, so its unmatched events and outliers are still reported
+        if lazy:
+            results[subject] = SubjectResults(subject, subject_data, outliers, unmatched, bin_width)
+        else:
+            results[subject] = get_subject_tables(subject, subject_data, outliers, unmatched, bin_width)
+
+    return results
+
+
+def get_subject_tables(subject, subject_data, outliers, unmatched, bin_width=DEFAULT_BIN_WIDTH):
+    stats = run_stage('get_behaviour_data_for_each_subject', get_behaviour_data_for_each_subject, 
+                      subject_data, subject=subject)
+    bouts_data = run_stage('generate_bouts_df', generate_bouts_df, subject_data, subject=subject)
+    bout_stats = run_stage('calculate_bout_stats', calculate_bout_stats, bouts_data, subject=subject)
+    summary_df =  run_stage('get_time_doing_behaviour', get_time_doing_behaviour, subject_data, subject=subject)
+    interbout_stats = run_stage('get_interbout_statistics', get_interbout_statistics, subject_data, 
+                                subject=subject)
+    time_budget = run_stage('get_time_budget', get_time_budget, subject_data, bin_width, subject=subject)
+
+    return {
+        'raw_behavioural_data': subject_data,
+        'statistics': stats,
+        'bouts_data': bouts_data,
+        'bout_statistics': bout_stats,
+        'location_statistics': summary_df,
+        'interbout_statistics': interbout_stats,
+        'time_budget': time_budget,
+        'outliers': outliers,
+        'unmatched_events': unmatched,
+    }
+
+
+def run_pipeline_for_all_subjects(df, gap=DEFAULT_GAP, min_duration=DEFAULT_MIN_DURATION,
+                                  std_deviation_multiplier=DEFAULT_STD_DEVIATION_MULTIPLIER, lazy=False,
+                                  bin_width=DEFAULT_BIN_WIDTH):
+    '''
+    Runs every stage once over the whole dataset and then 
+    splits the tables by subject, so the result is the same
+    as run_pipeline gives when it loops over the subjects.
+    '''
+    data = run_stage('get_behaviour_modifiers', get_behaviour_modifiers, df)
+    all_bouts, all_outliers, all_unmatched = run_stage('get_bouts_for_all_subjects', get_bouts_for_all_subjects, 
+                                                       data, gap, min_duration, std_deviation_multiplier)
+    # every subject gets results, even one with no matched events
+    subjects = list(data['Subject'].unique())
+    if lazy:
+        return run_stage('split_bouts_by_subject', split_bouts_by_subject, all_bouts, all_outliers, all_unmatched,
+                         bin_width, subjects)
+
+    stats = run_stage('get_behaviour_data_for_each_subject', get_behaviour_data_for_each_subject, all_bouts)
+    bouts_data = run_stage('generate_bouts_df', generate_bouts_df, all_bouts)
+    bout_stats = run_stage('calculate_bout_stats', calculate_bout_stats, bouts_data)
+    summary_df = run_stage('get_time_doing_behaviour', get_time_doing_behaviour, all_bouts)
+    interbout_stats = run_stage('get_interbout_statistics', get_interbout_statistics, all_bouts)
+    time_budget = run_stage('get_time_budget', get_time_budget, all_bouts, bin_width)
+
+    return run_stage('split_results_by_subject', split_results_by_subject, all_bouts, all_outliers, all_unmatched,
+                     stats, bouts_data, bout_stats, summary_df, interbout_stats, time_budget, subjects, bin_width)
+
+
+def split_results_by_subject(all_bouts, all_outliers, all_unmatched, stats, bouts_data, bout_stats, summary_df,
+                             interbout_stats, time_budget, subjects=None, bin_width=DEFAULT_BIN_WIDTH):
+    '''
+    Splits the whole-dataset tables into each subject's results.
+    `subjects` can include subjects with no matched events, whose 
+    tables are built from no events (see get_subject_tables), so 
+    their outliers and unmatched events are still reported.
+    '''
+    # tables pivoted over every subject have a column for every behaviour 
+    # and modifier in the dataset, so keep only the ones each subject has
+    behaviour_modifiers = (all_bouts['Behavior'] + '_' + all_bouts['Modifier']).groupby(all_bouts['Subject'], observed=True).unique()
+    modifiers = all_bouts.groupby('Subject', observed=True)['Modifier'].unique()
+    count_columns = [col for col in stats.columns if col.startswith('Observation id_count_')]
+    stats[count_columns] = stats[count_columns].astype(int)
+
+    raw_by_subject = dict(tuple(all_bouts.groupby('Subject', sort=False, observed=True)))
+    bouts_by_subject = dict(tuple(bouts_data.groupby(level='Subject', sort=False, observed=True)))
+    outliers_by_subject = dict(tuple(all_outliers.groupby('Subject', sort=False, observed=True)))
+    unmatched_by_subject = dict(tuple(all_unmatched.groupby('Subject', sort=False, observed=True)))
+    time_budget_by_subject = dict(tuple(time_budget.groupby('Subject', sort=False, observed=True)))
+    results = {}
+    for subject in subjects if subjects is not None else raw_by_subject:
+        outliers = outliers_by_subject.get(subject, all_outliers.iloc[:0])
+        unmatched = unmatched_by_subject.get(subject, all_unmatched.iloc[:0]).reset_index(drop=True)
+        if subject not in raw_by_subject:
+            results[subject] = get_subject_tables(subject, all_bouts.iloc[:0], outliers, unmatched, bin_width)
+            continue
+        subject_data = raw_by_subject[subject]
+        subject_stats = stats.loc[[subject], [col for col in stats.columns 
+                                              if col.split('_', 2)[-1] in behaviour_modifiers[subject]]]
+        subject_bout_stats = bout_stats.loc[[subject]].drop(columns='mixed_proportion').dropna(axis=1)
+        subject_bout_stats['mixed_proportion'] = subject_bout_stats.get('mixed_count', 0) / subject_bout_stats['all_count']
+        subject_summary = summary_df.loc[[subject], ['Behavior'] + [col for col in summary_df.columns 
+                                                                    if col in modifiers[subject]]]
 
         results[subject] = {
             'raw_behavioural_data': subject_data,
-            'statistics': stats,
-            'bouts_data': bouts_data,
-            'bout_statistics': bout_stats,
-            'location_statistics': summary_df,
+            'statistics': subject_stats,
+            'bouts_data': bouts_by_subject[subject],
+            'bout_statistics': subject_bout_stats,
+            'location_statistics': subject_summary,
+            'interbout_statistics': interbout_stats.loc[[subject]],
+            'time_budget': time_budget_by_subject[subject].reset_index(drop=True),
             'outliers': outliers,
+            'unmatched_events': unmatched,
         }
 
-    return results
\ No newline at end of file
+    return results
+
+
+def split_bouts_by_subject(all_bouts, all_outliers, all_unmatched, bin_width=DEFAULT_BIN_WIDTH, subjects=None):
+    raw_by_subject = dict(tuple(all_bouts.groupby('Subject', sort=False, observed=True)))
+    outliers_by_subject = dict(tuple(all_outliers.groupby('Subject', sort=False, observed=True)))
+    unmatched_by_subject = dict(tuple(all_unmatched.groupby('Subject', sort=False, observed=True)))
+    return {
+        subject: SubjectResults(subject, raw_by_subject.get(subject, all_bouts.iloc[:0]), 
+                                outliers_by_subject.get(subject, all_outliers.iloc[:0]),
+                                unmatched_by_subject.get(subject, all_unmatched.iloc[:0]).reset_index(drop=True),
+                                bin_width)
+        for subject in (subjects if subjects is not None else raw_by_subject)
+    }
+
+
+def compact_results(results) -> tuple[dict, dict, pd.DataFrame]:
+    '''
+    Rebuilds each subject's event tables as slices of one shared,
+    compactly typed frame per table, rather than a copy per subject.
+    The shared frame is laid out as combine_subject_tables lays out
+    the combined table (indexed by subject, as a categorical), so it
+    can be used as the combined table without another copy. Tables 
+    of SubjectResults that haven't been computed yet are left for 
+    later. Returns the results, the shared frames of the tables every
+    subject has, and a report of the bytes each table took up before
+    and after.
+    '''
+    results = {subject: subject_results if isinstance(subject_results, SubjectResults) else dict(subject_results)
+               for subject, subject_results in results.items()}
+    combined = {}
+    report = []
+    for table in EVENT_TABLES:
+        subjects = [subject for subject, subject_results in results.items() if has_table(subject_results, table)]
+        if not subjects:
+            continue
+        frames = [results[subject][table] for subject in subjects]
+        shared = compact_frame(combine_subject_tables({subject: results[subject] for subject in subjects}, table))
+        shared.index = pd.CategoricalIndex(shared.index, categories=subjects, name='Subject')
+        # the subjects' rows follow each other, so each subject gets a slice, which is a view
+        ends = np.cumsum([len(frame) for frame in frames])
+        starts = np.concatenate([[0], ends[:-1]])
+        for subject, start, end in zip(subjects, starts, ends):
+            set_table(results[subject], table, shared.iloc[start:end])
+        if len(subjects) == len(results):
+            combined[table] = shared
+        report.append({
+            'Table': table,
+            'Rows': len(shared),
+            'Bytes before': sum(frame.memory_usage(deep=True).sum() for frame in frames),
+            'Bytes after': shared.memory_usage(deep=True).sum(),
+        })
+    report = pd.DataFrame(report, columns=['Table', 'Rows', 'Bytes before', 'Bytes after'])
+    report['Saving'] = 1 - report['Bytes after'] / report['Bytes before']
+    return results, combined, report
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Stores text columns as categoricals, whole-number bout ids as
+    integers, and floats as float32 where that loses no more than
+    FLOAT32_TOLERANCE. Changes `df` in place and returns it.
+    '''
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object:
+            df[column] = values.astype('category')
+        elif column == 'bout_id' and values.notna().all() and (values % 1 == 0).all():
+            df[column] = values.astype(np.int32)
+        elif values.dtype == np.float64 and len(values) and (
+                (values.astype(np.float32).astype(np.float64) - values).abs().max() <= FLOAT32_TOLERANCE):
+            df[column] = values.astype(np.float32)
+    return df
+
+
+def has_table(subject_results, table: str) -> bool:
+    if isinstance(subject_results, SubjectResults):
+        return subject_results.is_computed(table)
+    return table in subject_results
+
+
+def set_table(subject_results, table: str, df: pd.DataFrame):
+    if isinstance(subject_results, SubjectResults):
+        subject_results.set_computed(table, df)
+    else:
+        subject_results[table] = df
+
+
+def combine_subject_tables(results, table: str) -> pd.DataFrame:
+    '''
+    Stacks one table of every subject's results into a single
+    table indexed by subject, with the columns sorted and the 
+    missing numbers filled in, apart from the event times and 
+    durations and the UNFILLED_TABLES. The subjects' own tables
+    are left as they are.
+    '''
+    subjects = list(results)
+    table_df = pd.concat([results[subject][table] for subject in subjects], keys=subjects, names=['Subject', None])
+    table_df.index = table_df.index.get_level_values('Subject')
+    table_df = table_df.drop(columns='Subject', errors='ignore').sort_index(axis=1)
+    if table in UNFILLED_TABLES:
+        return table_df
+    # categorical columns can't take a 0, and never have gaps to fill
+    numeric_columns = table_df.select_dtypes('number').columns.difference(UNFILLED_COLUMNS)
+    table_df[numeric_columns] = table_df[numeric_columns].fillna(0)
+    return table_df
+
+
+class TableIndex:
+    '''
+    The row positions of each subject, date and behaviour in a
+    combined table, so filtering is a lookup and an intersection
+    of positions rather than a scan of every row.
+    '''
+    def __init__(self, table):
+        self.positions = {}
+        for key in INDEX_KEYS:
+            values = table.index if key == table.index.name else table[key]
+            codes, uniques = pd.factorize(values, sort=True)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.positions[key] = {value: order[start:end] 
+                                   for value, start, end in zip(uniques, bounds[:-1], bounds[1:])}
+        self.starts = table['Time_start'].to_numpy(dtype=float)
+        self.stops = table['Time_stop'].to_numpy(dtype=float)
+
+    def get_values(self, key):
+        return list(self.positions[key])
+
+    def get_time_bounds(self):
+        if not len(self.starts):
+            return None
+        return float(self.starts.min()), float(self.stops.max())
+
+    def find_rows(self, filters: dict, time_range=None) -> np.ndarray:
+        '''
+        Positions, in table order, of the rows with one of the given 
+        values for every key in `filters` (keys left empty aren't 
+        filtered on) and any time within `time_range`.
+        '''
+        rows = None
+        for key, values in filters.items():
+            if not values:
+                continue
+            matches = np.sort(np.concatenate([self.positions[key].get(value, []) for value in values])).astype(int)
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        if rows is None:
+            rows = np.arange(len(self.starts))
+        if time_range is not None:
+            start, stop = time_range
+            rows = rows[(self.stops[rows] >= start) & (self.starts[rows] <= stop)]
+        return rows
+
+
+def get_subject_events(results) -> pd.DataFrame:
+    # compacted events have the subject in the index rather than a column (see compact_results)
+    events = results['raw_behavioural_data']
+    return events if 'Subject' in events.columns else events.reset_index()
+
+def get_behaviour_tables(results):
+    return {'statistics': get_behaviour_data_for_each_subject(get_subject_events(results))}
+
+def get_bout_tables(results):
+    # calculate_bout_stats renames and relabels the bouts_data columns, 
+    # so both are built together to look the same whichever is asked for first
+    bouts_data = generate_bouts_df(get_subject_events(results))
+    return {'bout_statistics': calculate_bout_stats(bouts_data), 'bouts_data': bouts_data}
+
+def get_location_tables(results):
+    return {'location_statistics': get_time_doing_behaviour(get_subject_events(results))}
+
+def get_interbout_tables(results):
+    return {'interbout_statistics': get_interbout_statistics(get_subject_events(results))}
+
+def get_time_budget_tables(results):
+    return {'time_budget': get_time_budget(get_subject_events(results), results.bin_width)}
+
+
+class SubjectResults(Mapping):
+    '''
+    The result tables of one subject, as a read-only mapping 
+    from table name to DataFrame. Only the matched events, 
+    outliers and unmatched events are kept from the start;
+    every other table is computed from the matched events the
+    first time it is looked up, and then kept.
+    '''
+    TABLE_BUILDERS = {
+        'statistics': get_behaviour_tables,
+        'bouts_data': get_bout_tables,
+        'bout_statistics': get_bout_tables,
+        'location_statistics': get_location_tables,
+        'interbout_statistics': get_interbout_tables,
+        'time_budget': get_time_budget_tables,
+    }
+    TABLES = ['raw_behavioural_data', 'statistics', 'bouts_data', 'bout_statistics', 'location_statistics',
+              'interbout_statistics', 'time_budget', 'outliers', 'unmatched_events']
+
+    def __init__(self, subject, bouts, outliers, unmatched, bin_width=DEFAULT_BIN_WIDTH):
+        self.subject = subject
+        self.bin_width = bin_width
+        self._tables = {'raw_behavioural_data': bouts, 'outliers': outliers, 'unmatched_events': unmatched}
+
+    def __getitem__(self, name):
+        if name not in self._tables:
+            if name not in self.TABLE_BUILDERS:
+                raise KeyError(name)
+            builder = self.TABLE_BUILDERS[name]
+            self._tables.update(run_stage(builder.__name__, builder, self, subject=self.subject))
+        return self._tables[name]
+
+    def __iter__(self):
+        return iter(self.TABLES)
+
+    def __len__(self):
+        return len(self.TABLES)
+
+    def is_computed(self, name):
+        return name in self._tables
+
+    def set_computed(self, name, df):
+        # for swapping a table for an equal one, e.g. a view into a shared frame
+        self._tables[name] = df
+
+
+class ObservationStore:
+    '''
+    Keeps the bouts, outliers and duration aggregates of every
+    observation separately. Bouts never cross an observation date,
+    so when a new export is added only its observations are run
+    through the pipeline, and the stored ones are merged in.
+    Bout ids carry on from the subject's earlier observations,
+    so they match a full run over the files in the same order.
+    An observation's aggregates are only worked out the first time
+    eager results are asked for, since lazy results build their 
+    tables from the bouts.
+    '''
+    def __init__(self, gap=DEFAULT_GAP, min_duration=DEFAULT_MIN_DURATION,
+                 std_deviation_multiplier=DEFAULT_STD_DEVIATION_MULTIPLIER, bin_width=DEFAULT_BIN_WIDTH):
+        self.gap = gap
+        self.min_duration = min_duration
+        self.std_deviation_multiplier = std_deviation_multiplier
+        self.bin_width = bin_width
+        self.partitions = {}
+        self.fingerprints = {}
+        self.observation_order = []
+        self.subject_order = []
+
+    def update(self, df: pd.DataFrame, progress=None, cancelled=None) -> list:
+        '''
+        Brings the store in line with `df`: new or changed observations 
+        are processed, and ones that are no longer in `df` are dropped.
+        Returns the ids of the observations that were processed.
+        `progress` is called with the number of observations done so
+        far and the total. If `cancelled` (a threading.Event) is set, 
+        the update stops before its next observation, and the store 
+        is only brought up to date by the next update.
+        '''
+        processed = []
+        self.observation_order = []
+        self.subject_order = list(df['Subject'].unique())
+        observations = df.groupby('Observation id', sort=False, observed=True)
+        for done, (observation, observation_data) in enumerate(observations):
+            if progress is not None:
+                progress(done, observations.ngroups)
+            if cancelled is not None and cancelled.is_set():
+                return processed
+            fingerprint = pd.util.hash_pandas_object(observation_data, index=False).sum()
+            self.observation_order.append(observation)
+            if self.fingerprints.get(observation) == fingerprint:
+                continue
+            print(f'Processing observation {observation}')
+            self.partitions[observation] = self._process_observation(observation_data)
+            self.fingerprints[observation] = fingerprint
+            processed.append(observation)
+        if progress is not None:
+            progress(observations.ngroups, observations.ngroups)
+
+        for observation in set(self.partitions) - set(self.observation_order):
+            del self.partitions[observation]
+            del self.fingerprints[observation]
+
+        return processed
+
+    def _process_observation(self, df):
+        observation = df['Observation id'].iloc[0]
+        data = run_stage('get_behaviour_modifiers', get_behaviour_modifiers, df, source=observation)
+        bouts, outliers, unmatched = run_stage('get_bouts_for_all_subjects', get_bouts_for_all_subjects, data, 
+                                               self.gap, self.min_duration, self.std_deviation_multiplier, 
+                                               source=observation)
+        return {'bouts': bouts, 'outliers': outliers, 'unmatched': unmatched}
+
+    def _add_aggregates(self, observation, partition):
+        if 'bouts_data' in partition:
+            return
+        bouts = partition['bouts']
+        # an observation with no matched events still gets (empty) tables, so it merges like any other
+        bouts_data = run_stage('generate_bouts_df', generate_bouts_df, bouts, source=observation)
+        partition['bouts_data'] = bouts_data
+        partition['behaviour_aggregates'] = run_stage('get_duration_aggregates', get_duration_aggregates,
+            bouts, BEHAVIOUR_KEYS, 'Behaviour Duration (s)', source=observation)
+        partition['bout_aggregates'] = run_stage('get_duration_aggregates', get_duration_aggregates,
+            bouts_data.reset_index(), ['Subject', 'mixed_bout'], 'Behaviour Duration (s)', source=observation)
+        partition['interbout_aggregates'] = run_stage('get_interbout_aggregates', get_interbout_aggregates, bouts,
+                                                      source=observation)
+        # bins never span two observations, so each observation's budget is final
+        partition['time_budget'] = run_stage('get_time_budget', get_time_budget, bouts, self.bin_width, 
+                                             source=observation)
+
+    def get_results(self, lazy=False):
+        partitions = [self.partitions[observation] for observation in self.observation_order]
+        if not lazy:
+            for observation, partition in zip(self.observation_order, partitions):
+                self._add_aggregates(observation, partition)
+        all_outliers = pd.concat([partition['outliers'] for partition in partitions])
+        all_unmatched = pd.concat([partition['unmatched'] for partition in partitions], ignore_index=True)
+        # every subject gets results, even one with no matched events in any observation
+        subjects = self.subject_order
+        if not subjects:
+            return {}
+
+        all_bouts, bouts_data = [], []
+        last_bout_ids = {}
+        for partition in partitions:
+            # each observation numbers its bouts from 1, so shift them past the subject's earlier bouts
+            subject_last_ids = partition['bouts'].groupby('Subject', observed=True)['bout_id'].max()
+            offsets = pd.Series({subject: last_bout_ids.get(subject, 0) for subject in subject_last_ids.index}, dtype=float)
+            bouts = partition['bouts'].copy()
+            bouts['bout_id'] += bouts['Subject'].map(offsets).astype(float)
+            all_bouts.append(bouts)
+            if not lazy:
+                subject_bouts = partition['bouts_data'].copy()
+                subject_bouts['bout_id'] += offsets.reindex(subject_bouts.index).to_numpy()
+                bouts_data.append(subject_bouts)
+            for subject, last_id in subject_last_ids.items():
+                last_bout_ids[subject] = last_bout_ids.get(subject, 0) + last_id
+        all_bouts = pd.concat(all_bouts)
+        if lazy:
+            return run_stage('split_bouts_by_subject', split_bouts_by_subject, all_bouts, all_outliers, all_unmatched,
+                             self.bin_width, subjects)
+        bouts_data = pd.concat(bouts_data)
+        bouts_data.rename(columns={'Behaviour Duration (s)': 'Bout Duration (s)'}, inplace=True)
+        bouts_data['mixed_bout'] = bouts_data['mixed_bout'].map({True: 'Mixed', False: 'Non-mixed'})
+
+        behaviour_aggregates = combine_duration_aggregates(
+            [partition['behaviour_aggregates'] for partition in partitions], BEHAVIOUR_KEYS)
+        stats = get_behaviour_statistics_from_aggregates(behaviour_aggregates)
+        bout_aggregates = combine_duration_aggregates(
+            [partition['bout_aggregates'] for partition in partitions], ['Subject', 'mixed_bout'])
+        bout_aggregates['mixed_bout'] = bout_aggregates['mixed_bout'].map({True: 'Mixed', False: 'Non-mixed'})
+        bout_stats = get_bout_statistics_from_aggregates(bout_aggregates)
+        summary_df = get_time_doing_behaviour_from_aggregates(behaviour_aggregates)
+        interbout_stats = get_interbout_statistics_from_aggregates(combine_duration_aggregates(
+            [partition['interbout_aggregates'] for partition in partitions], ['Subject']))
+        # in the order a single run over all the observations gives
+        time_budget = pd.concat([partition['time_budget'] for partition in partitions], ignore_index=True)
+        time_budget = time_budget.sort_values(['Subject', 'Observation id', 'Observation date', 'Bin start (s)', 
+                                               'Behavior', 'Modifier'], kind='stable', ignore_index=True)
+
+        return run_stage('split_results_by_subject', split_results_by_subject, all_bouts, all_outliers, 
+                         all_unmatched, stats, bouts_data, bout_stats, summary_df, interbout_stats, time_budget,
+                         subjects, self.bin_width)
+
+
+def run_pipeline_in_parallel(df, workers, gap=DEFAULT_GAP, min_duration=DEFAULT_MIN_DURATION,
+                             std_deviation_multiplier=DEFAULT_STD_DEVIATION_MULTIPLIER, lazy=False,
+                             bin_width=DEFAULT_BIN_WIDTH):
+    '''
+    Runs the pipeline for each subject in a separate process.
+    Subjects are independent and bout ids are numbered per subject,
+    so the merged results are the same as a serial run.
+    Each worker gets its subject's columns as plain arrays
+    rather than a pickled DataFrame (see get_payload).
+    '''
+    payloads = [get_payload(subject_data) for _, subject_data in df.groupby('Subject', sort=False, observed=True)]
+    run_subject = partial(run_pipeline_for_payload, gap=gap, min_duration=min_duration, 
+                          std_deviation_multiplier=std_deviation_multiplier, lazy=lazy, bin_width=bin_width)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps the subjects in submission order, so the output is deterministic
+        for subject_results in executor.map(run_subject, payloads):
+            results.update(subject_results)
+
+    return results
+
+
+def get_payload(df: pd.DataFrame) -> dict:
+    '''
+    The columns of `df` as numpy arrays. Text columns are sent as 
+    integer codes with their categories, so that a payload pickles 
+    to little more than its numbers instead of one string per row. 
+    get_frame_from_payload rebuilds the frame with the same dtypes.
+    '''
+    payload = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+            categorical = values.astype('category')
+            payload[column] = (categorical.cat.codes.to_numpy(), categorical.dtype, values.dtype)
+        else:
+            payload[column] = values.to_numpy()
+    return payload
+
+
+def get_frame_from_payload(payload: dict) -> pd.DataFrame:
+    columns = {}
+    for column, values in payload.items():
+        if isinstance(values, tuple):
+            codes, categorical_dtype, dtype = values
+            values = pd.Categorical.from_codes(codes, dtype=categorical_dtype)
+            if not isinstance(dtype, pd.CategoricalDtype):
+                values = values.astype(dtype)
+        columns[column] = values
+    return pd.DataFrame(columns)
+
+
+def run_pipeline_for_payload(payload: dict, gap=DEFAULT_GAP, min_duration=DEFAULT_MIN_DURATION,
+                             std_deviation_multiplier=DEFAULT_STD_DEVIATION_MULTIPLIER, lazy=False,
+                             bin_width=DEFAULT_BIN_WIDTH):
+    return run_pipeline_for_all_subjects(get_frame_from_payload(payload), gap, min_duration, 
+                                         std_deviation_multiplier, lazy, bin_width)
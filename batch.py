@@ -0,0 +1,116 @@
+import argparse
+import glob
+import os
+from pathlib import Path
+import pandas as pd
+import backend as be
+
+INPUT_SUFFIXES = ['.tsv', '.csv']
+OUTPUT_FORMATS = ['csv', 'parquet', 'xlsx']
+DEFAULT_OUTPUT_DIR = 'batch_output'
+
+
+def find_input_files(inputs: list[str]) -> list[Path]:
+    '''
+    Expands each input, which can be a directory of exports,
+    a glob like new_data/*.tsv, or a single file.
+    Files are kept in the order given, sorted within each input,
+    and a file matched twice is only read once.
+    '''
+    paths = []
+    for pattern in inputs:
+        if Path(pattern).is_dir():
+            matches = [path for path in Path(pattern).iterdir() if path.suffix in INPUT_SUFFIXES]
+        else:
+            matches = [Path(path) for path in glob.glob(pattern)]
+        if not matches:
+            print(f'No exports found for {pattern}')
+        paths.extend(path for path in sorted(matches) if path not in paths)
+    return paths
+
+
+def write_tables(tables: dict[str, pd.DataFrame], output_dir, file_format: str) -> list[Path]:
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if file_format == 'xlsx':
+        path = output_dir / 'behavioural_output.xlsx'
+        path.write_bytes(be.write_to_excel(tables))
+        return [path]
+
+    paths = []
+    for name, table in tables.items():
+        path = output_dir / f'{name}.{file_format}'
+        if file_format == 'parquet':
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def run_batch(paths, output_dir, file_format='csv', gap=be.DEFAULT_GAP, min_duration=be.DEFAULT_MIN_DURATION,
+              std_deviation_multiplier=be.DEFAULT_STD_DEVIATION_MULTIPLIER, workers=None, read_workers=None,
+              engine=None, cache_dir=None, recorder=None, bin_width=be.DEFAULT_BIN_WIDTH) -> list[Path]:
+    '''
+    Runs the whole pipeline over the exports at `paths` and writes
+    one table per result type, with every subject in it, to `output_dir`.
+    Returns the paths of the files that were written.
+    '''
+    recorder = recorder or be.StageRecorder()
+    with be.instrumented(recorder):
+        dfs = be.import_input_files(paths, engine=engine, cache_dir=cache_dir, workers=read_workers)
+        results = be.run_pipeline(be.concat_input_tables(dfs), grouped=True, workers=workers, gap=gap,
+                                  min_duration=min_duration, std_deviation_multiplier=std_deviation_multiplier,
+                                  bin_width=bin_width)
+        if not results:
+            print('The exports have no events, so there is nothing to write')
+            return []
+        table_names = list(next(iter(results.values())))
+        tables = {name: be.run_stage('combine_subject_tables', be.combine_subject_tables, results, name).reset_index()
+                  for name in table_names}
+        tables['pair_synchrony'], tables['group_synchrony'] = be.run_stage(
+            'get_synchrony', be.get_synchrony, tables['raw_behavioural_data'])
+        return be.run_stage('write_tables', write_tables, tables, output_dir, file_format)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the behavioural analysis pipeline over BORIS exports '
+                                                 'without the Streamlit app.')
+    parser.add_argument('inputs', nargs='+', help='directories, globs (e.g. "new_data/*.tsv") or files')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('--gap', type=float, default=be.DEFAULT_GAP,
+                        help='seconds between events that still belong to the same bout')
+    parser.add_argument('--min-duration', type=float, default=be.DEFAULT_MIN_DURATION,
+                        help='events shorter than this many seconds are dropped')
+    parser.add_argument('--std-deviation-multiplier', type=float, default=be.DEFAULT_STD_DEVIATION_MULTIPLIER,
+                        help='events more than this many standard deviations above the mean are outliers')
+    parser.add_argument('--bin-width', type=float, default=be.DEFAULT_BIN_WIDTH,
+                        help='seconds in each bin of the time budget')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes to run the subjects in. 1 runs them in this process, which is faster '
+                             'unless there are many subjects, and the only way the timing summary shows each stage')
+    parser.add_argument('--read-workers', type=int, default=os.cpu_count(), help='files to parse at once')
+    parser.add_argument('--engine', choices=['c', 'python', 'pyarrow'], help='pandas parser engine')
+    parser.add_argument('--cache-dir', help='keep the parsed exports here, so unchanged files are only parsed once')
+    parser.add_argument('--trace', help='also write a Chrome trace of the stages to this file')
+    args = parser.parse_args()
+    if args.workers > 1:
+        print(f'Running the subjects in {args.workers} processes, so the timing summary only has the whole run')
+
+    paths = find_input_files(args.inputs)
+    if not paths:
+        parser.error('no input files found')
+
+    recorder = be.StageRecorder()
+    written = run_batch(paths, args.output_dir, args.format, args.gap, args.min_duration,
+                        args.std_deviation_multiplier, args.workers, args.read_workers, args.engine,
+                        args.cache_dir, recorder, args.bin_width)
+    print(recorder.summary().to_string())
+    if args.trace:
+        recorder.write_trace(args.trace)
+    print(f'Wrote {len(written)} files from {len(paths)} exports to {args.output_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import datetime
+import io
+import json
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import backend as be
+from synthetic_data import generate_exports
+
+BENCHMARK_TIERS = {
+    'small': dict(subjects=5, dates=3, events_per_subject=100),
+    'medium': dict(subjects=20, dates=10, events_per_subject=200),
+    'large': dict(subjects=50, dates=30, events_per_subject=300),
+}
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+
+def get_bouts_for_each_subject(df):
+    all_bouts = []
+    for subject_data in be.separate_data_by_subject(df).values():
+        bouts, *_ = be.get_bouts(subject_data, be.DEFAULT_GAP)
+        all_bouts.append(bouts)
+    return pd.concat(all_bouts)
+
+
+def time_stage(stage, make_input, repeats):
+    '''
+    Times `stage` on a fresh input each repeat, since several
+    stages change their input in place. Peak memory is taken
+    from one extra run under tracemalloc, so that tracing
+    doesn't slow down the timed runs.
+    '''
+    times = []
+    for _ in range(repeats):
+        stage_input = make_input()
+        start = time.perf_counter()
+        output = stage(stage_input)
+        times.append(time.perf_counter() - start)
+
+    stage_input = make_input()
+    tracemalloc.start()
+    stage(stage_input)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'times_s': times,
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_memory_bytes': peak_memory,
+        'rows_in': count_rows(stage_input),
+        'rows_out': count_rows(output),
+    }
+
+
+def count_rows(data):
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    if isinstance(data, tuple):
+        return count_rows(data[0])
+    if isinstance(data, dict):
+        return sum(count_rows(value) for value in data.values())
+    if isinstance(data, list):
+        return sum(count_rows(value) for value in data)
+    if isinstance(data, io.BytesIO):
+        # an export file, less its header
+        return data.getvalue().count(b'\n') - 1
+    return None
+
+
+def run_tier(tier, repeats, seed=0):
+    with tempfile.TemporaryDirectory() as data_dir:
+        paths = generate_exports(data_dir, seed=seed, **BENCHMARK_TIERS[tier])
+        exports = [path.read_bytes() for path in paths]
+
+    def make_files():
+        # the pipeline expects uploaded files, which have a name and can be seeked
+        files = []
+        for path, content in zip(paths, exports):
+            file = io.BytesIO(content)
+            file.name = path.name
+            files.append(file)
+        return files
+
+    raw_data = be.concat_input_tables(be.import_input_files(make_files()))
+    modified = be.get_behaviour_modifiers(raw_data.copy())
+    bouts, *_ = be.get_bouts_for_all_subjects(modified, be.DEFAULT_GAP)
+    bouts_data = be.generate_bouts_df(bouts)
+
+    stages = {
+        'import_input_files': (be.import_input_files, make_files),
+        'get_behaviour_modifiers': (be.get_behaviour_modifiers, raw_data.copy),
+        'match_start_and_stop_for_behaviour': (be.match_start_and_stop_for_behaviour,
+                                               lambda: modified.sort_values('Time')),
+        'get_bouts': (get_bouts_for_each_subject, modified.copy),
+        'get_bouts_for_all_subjects': (lambda df: be.get_bouts_for_all_subjects(df, be.DEFAULT_GAP), modified.copy),
+        'get_behaviour_data_for_each_subject': (be.get_behaviour_data_for_each_subject, bouts.copy),
+        'generate_bouts_df': (be.generate_bouts_df, bouts.copy),
+        'calculate_bout_stats': (be.calculate_bout_stats, bouts_data.copy),
+        'get_time_doing_behaviour': (be.get_time_doing_behaviour, bouts.copy),
+        'run_pipeline': (be.run_pipeline, raw_data.copy),
+        'run_pipeline_grouped': (lambda df: be.run_pipeline(df, grouped=True), raw_data.copy),
+    }
+    results = []
+    for stage, (function, make_input) in stages.items():
+        print(f'Benchmarking {stage} on the {tier} tier')
+        result = time_stage(function, make_input, repeats)
+        results.append({'tier': tier, 'stage': stage, **BENCHMARK_TIERS[tier], **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory-profile each stage of the pipeline on synthetic exports.')
+    parser.add_argument('--tiers', nargs='+', choices=list(BENCHMARK_TIERS), default=['small', 'medium'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    results = []
+    for tier in args.tiers:
+        results.extend(run_tier(tier, args.repeats, args.seed))
+
+    report = {
+        'metadata': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'repeats': args.repeats,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+
+    summary = pd.DataFrame(results).set_index(['tier', 'stage'])[['median_s', 'peak_memory_bytes', 'rows_in', 'rows_out']]
+    print(summary.to_string())
+    print(f'Saved results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
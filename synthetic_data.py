@@ -0,0 +1,126 @@
+import argparse
+import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+BORIS_COLUMNS = ['Observation id', 'Observation date', 'Description', 'Observation duration',
+                 'Observation type', 'Source', 'Media duration (s)', 'FPS', 'Subject', 'Behavior',
+                 'Behavioral category', 'Behavior type', 'Time', 'Media file name', 'Image index',
+                 'Image file path', 'Comment']
+# behaviour -> (relative frequency, areas it can happen in)
+DEFAULT_BEHAVIOURS = {
+    'BR': (0.85, ['A', 'B', 'C', 'D']),
+    'TWRL': (0.08, ['A', 'D']),
+    'BKFL': (0.02, ['E', 'F']),
+    'RT': (0.03, ['H', 'I', 'J']),
+    'LIDRT': (0.02, ['A', 'D']),
+}
+FIRST_OBSERVATION = datetime.datetime(2023, 9, 2, 7, 49, 16)
+
+
+def generate_observation(rng: np.random.Generator, observation_id: str, observation_date: datetime.datetime,
+                         subjects: list[str], events_per_subject: int, session_duration: float = 14755.061,
+                         behaviours: dict = DEFAULT_BEHAVIOURS, overlap_probability: float = 0.1,
+                         outlier_probability: float = 0.01) -> pd.DataFrame:
+    '''
+    Generates one BORIS export: a START and a STOP row for every
+    event, sorted by time. Each subject's events follow each other
+    with exponential gaps; some start before the previous event
+    has stopped (overlaps), some are far longer than usual (outliers),
+    and some are shorter than the pipeline's minimum duration.
+    '''
+    n_subjects = len(subjects)
+    n_events = n_subjects * events_per_subject
+    shape = (n_subjects, events_per_subject)
+
+    durations = rng.lognormal(mean=3.0, sigma=0.8, size=shape)
+    durations[rng.random(shape) < outlier_probability] *= 8
+    gaps = rng.exponential(scale=session_duration / (events_per_subject * 2), size=shape)
+    overlaps = rng.random(shape) < overlap_probability
+    # an overlapping event starts part-way through the previous one
+    previous_durations = np.concatenate([np.zeros((n_subjects, 1)), durations[:, :-1]], axis=1)
+    gaps[overlaps] = -rng.random(overlaps.sum()) * previous_durations[overlaps]
+    starts = np.cumsum(gaps + previous_durations, axis=1)
+    stops = starts + durations
+
+    behaviour_names = list(behaviours)
+    weights = np.array([behaviours[name][0] for name in behaviour_names])
+    behaviour_index = rng.choice(len(behaviour_names), size=shape, p=weights / weights.sum())
+    # overlapping events are always a different behaviour, as BORIS state events can't overlap themselves
+    previous_index = np.concatenate([np.full((n_subjects, 1), -1), behaviour_index[:, :-1]], axis=1)
+    repeated = overlaps & (behaviour_index == previous_index)
+    behaviour_index[repeated] = (behaviour_index[repeated] + 1) % len(behaviour_names)
+    area_choices = rng.random(shape)
+    behaviour_labels = np.empty(shape, dtype=object)
+    for i, name in enumerate(behaviour_names):
+        areas = behaviours[name][1]
+        in_behaviour = behaviour_index == i
+        area_index = (area_choices[in_behaviour] * len(areas)).astype(int)
+        behaviour_labels[in_behaviour] = [f'{name}_{areas[j]}' for j in area_index]
+
+    events = pd.DataFrame({
+        'Subject': np.repeat(subjects, events_per_subject),
+        'Behavior': behaviour_labels.ravel(),
+        'start': starts.ravel().round(3),
+        'stop': stops.ravel().round(3),
+    })
+    events = events[events['stop'] < session_duration]
+    rows = pd.concat([
+        events.assign(**{'Behavior type': 'START', 'Time': events['start']}),
+        events.assign(**{'Behavior type': 'STOP', 'Time': events['stop']}),
+    ]).drop(columns=['start', 'stop'])
+    rows = rows.sort_values('Time', kind='stable', ignore_index=True)
+
+    rows['Observation id'] = observation_id
+    rows['Observation date'] = observation_date.strftime('%Y-%m-%d %H:%M:%S')
+    rows['Description'] = ''
+    rows['Observation duration'] = session_duration
+    rows['Observation type'] = 'Live observation'
+    rows['Behavioral category'] = rows['Behavior'].str.split('_', n=1).str[0]
+    rows['Comment'] = ''
+    for column in ['Source', 'Media duration (s)', 'FPS', 'Media file name', 'Image index', 'Image file path']:
+        rows[column] = 'NA'
+    print(f'Generated {len(events)} events for observation {observation_id} ({n_events - len(events)} ran past the end)')
+    return rows[BORIS_COLUMNS]
+
+
+def generate_exports(output_dir, subjects: int = 10, dates: int = 3, events_per_subject: int = 100,
+                     seed: int = 0, **kwargs) -> list[Path]:
+    '''
+    Writes one TSV per observation date into `output_dir`,
+    in the same layout as the exports in new_data/.
+    Returns the paths of the files that were written.
+    '''
+    rng = np.random.default_rng(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    subject_names = [f'DMO-{i + 1}' for i in range(subjects)]
+    paths = []
+    for day in range(dates):
+        observation_id = f'Sim{day + 1:03d}'
+        observation_date = FIRST_OBSERVATION + datetime.timedelta(days=day, minutes=int(rng.integers(0, 15)))
+        observation = generate_observation(rng, observation_id, observation_date, subject_names,
+                                           events_per_subject, **kwargs)
+        path = output_dir / f'{observation_id}.tsv'
+        observation.to_csv(path, sep='\t', index=False)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic BORIS exports for benchmarking the pipeline.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--subjects', type=int, default=10)
+    parser.add_argument('--dates', type=int, default=3)
+    parser.add_argument('--events-per-subject', type=int, default=100, help='events per subject per observation')
+    parser.add_argument('--overlap-probability', type=float, default=0.1)
+    parser.add_argument('--outlier-probability', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_exports(args.output_dir, args.subjects, args.dates, args.events_per_subject, args.seed,
+                     overlap_probability=args.overlap_probability, outlier_probability=args.outlier_probability)
+
+
+if __name__ == '__main__':
+    main()
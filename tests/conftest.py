@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import backend as be
+
+
+@pytest.fixture(scope='session')
+def new_data():
+    # the BORIS exports checked into the repo, as one raw frame
+    paths = sorted((REPO_DIR / 'new_data').glob('*.tsv'))
+    return be.concat_input_tables(be.import_input_files(paths))
+
+
+@pytest.fixture(scope='session')
+def synthetic_data(tmp_path_factory):
+    # a few days of generated exports, with overlapping events and outliers
+    from synthetic_data import generate_exports
+    paths = generate_exports(tmp_path_factory.mktemp('exports'), subjects=6, dates=3, events_per_subject=60)
+    return be.concat_input_tables(be.import_input_files(paths))
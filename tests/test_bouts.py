@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import pandas as pd
+import backend as be
+
+
+def get_reference_bout_ids(bouts: pd.DataFrame, gap: float) -> pd.Series:
+    '''
+    The interval loop get_bouts used before bouts were found with a 
+    binary search: the events of each date are merged into bouts, and 
+    each event takes the id of the first bout its start falls within.
+    '''
+    # the index repeats from one date to the next, so the events are looked up by position
+    bout_ids = np.full(len(bouts), np.nan)
+    dates = bouts['Observation date'].to_numpy()
+    bout_id = 1
+    for date in pd.unique(dates):
+        positions = np.flatnonzero(dates == date)
+        starts = bouts['Time_start'].to_numpy()[positions]
+        stops = bouts['Time_stop'].to_numpy()[positions]
+        intervals = sorted(zip(starts, stops))
+        merged = [intervals[0]]
+        for start, stop in intervals:
+            previous_start, previous_stop = merged[-1]
+            if start - previous_stop <= gap:
+                merged[-1] = (previous_start, max(previous_stop, stop))
+            else:
+                merged.append((start, stop))
+        for position, event_start in zip(positions, starts):
+            for j, (start, stop) in enumerate(merged):
+                if start <= event_start <= stop:
+                    bout_ids[position] = bout_id + j
+                    break
+        bout_id += len(merged)
+    return pd.Series(bout_ids, index=bouts.index)
+
+
+def test_bout_ids_match_the_interval_loop(new_data):
+    for subject, subject_data in be.separate_data_by_subject(new_data).items():
+        subject_data = be.get_behaviour_modifiers(subject_data.copy())
+        bouts, _, _ = be.get_bouts(subject_data, be.DEFAULT_GAP)
+        if bouts.empty:
+            continue
+        expected_ids = get_reference_bout_ids(bouts, be.DEFAULT_GAP)
+        pd.testing.assert_series_equal(bouts['bout_id'], expected_ids, check_names=False)
+
+        expected_mixed = bouts.groupby(expected_ids)['Behavior'].transform('nunique') > 1
+        pd.testing.assert_series_equal(bouts['mixed_bout'], expected_mixed, check_names=False)
+
+
+def test_bout_ids_follow_the_gap(new_data):
+    subject_data = be.get_behaviour_modifiers(new_data[new_data['Subject'] == 'DMO-10'].copy())
+    for gap in [0, 5, 60]:
+        bouts, _, _ = be.get_bouts(subject_data, gap)
+        pd.testing.assert_series_equal(bouts['bout_id'], get_reference_bout_ids(bouts, gap), check_names=False)
+
+
+def get_reference_intervals(starts, stops, gap, groups):
+    '''
+    Merges the intervals of each group in a plain loop, 
+    extending the last merged interval or starting a new one.
+    '''
+    merged_starts, merged_stops = [], []
+    positions = np.empty(len(starts), dtype=np.int64)
+    for group in np.unique(groups):
+        group_start = len(merged_starts)
+        for i in sorted(np.flatnonzero(groups == group), key=lambda i: starts[i]):
+            if len(merged_starts) > group_start and starts[i] - merged_stops[-1] <= gap:
+                merged_stops[-1] = max(merged_stops[-1], stops[i])
+            else:
+                merged_starts.append(starts[i])
+                merged_stops.append(stops[i])
+            positions[i] = len(merged_starts) - 1
+    return np.array(merged_starts), np.array(merged_stops), positions
+
+
+@pytest.mark.parametrize('gap', [0, 2.5, 10])
+def test_merge_intervals_matches_the_loop(gap):
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(0, 500, 400).round(1)
+    stops = starts + rng.exponential(5, 400).round(1)
+    groups = rng.integers(0, 7, 400)
+    expected = get_reference_intervals(starts, stops, gap, groups)
+    for actual, expected_values in zip(be.merge_intervals(starts, stops, gap, groups=groups), expected):
+        np.testing.assert_array_equal(actual, expected_values)
+
+
+def test_merge_intervals_edge_cases():
+    # touching intervals merge at gap 0, a contained interval does not extend the bout
+    starts, stops, positions = be.merge_intervals(np.array([0., 5., 1., 20.]), np.array([5., 6., 2., 21.]), 0)
+    np.testing.assert_array_equal(starts, [0., 20.])
+    np.testing.assert_array_equal(stops, [6., 21.])
+    np.testing.assert_array_equal(positions, [0, 0, 0, 1])
+
+    # the same intervals in different groups stay apart
+    _, _, positions = be.merge_intervals(np.array([0., 1.]), np.array([2., 3.]), 0, groups=np.array([1, 0]))
+    np.testing.assert_array_equal(positions, [1, 0])
+
+    starts, stops, positions = be.merge_intervals(np.array([]), np.array([]), 0)
+    assert len(starts) == len(stops) == len(positions) == 0
@@ -0,0 +1,68 @@
+import io
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+import backend as be
+
+
+@pytest.fixture
+def tables():
+    # a categorical column, whole and fractional numbers, and a missing time, as in unmatched_events
+    return {
+        'unmatched_events': pd.DataFrame({
+            'Subject': pd.Categorical(['DMO-1', 'DMO-1', 'DMO-2']),
+            'Time_start': [1.5, np.nan, 3.25],
+            'Time_stop': [np.nan, 2.0, 4.0],
+            'Problem': ['no STOP', 'no START', 'negative duration'],
+        }),
+        'bouts_data': pd.DataFrame({'Subject': ['DMO-1'] * 7, 'bout_id': np.arange(1, 8),
+                                    'Bout Duration (s)': np.linspace(1, 4, 7)}),
+        'empty': pd.DataFrame({'Subject': pd.Series(dtype=object), 'Time_start': pd.Series(dtype=float)}),
+    }
+
+
+def assert_same_table(expected, actual):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                  check_dtype=False, check_categorical=False)
+
+
+def test_excel_round_trip(tables):
+    sheets = pd.read_excel(io.BytesIO(be.write_to_excel(tables)), sheet_name=None)
+    assert list(sheets) == list(tables)
+    for name, table in tables.items():
+        # missing values are written as empty cells, which read back as NaN
+        assert_same_table(table.astype({'Subject': object}), sheets[name])
+
+
+def test_excel_splits_long_tables_across_sheets(tables, monkeypatch):
+    # three rows and the header fit on a sheet, and rows are written two at a time
+    monkeypatch.setattr(be, 'EXCEL_MAX_ROWS', 4)
+    monkeypatch.setattr(be, 'EXPORT_CHUNK_SIZE', 2)
+    long_name = 'a_table_name_that_is_longer_than_excel_allows'
+    workbook = be.write_to_excel({long_name: tables['bouts_data'], 'empty': tables['empty']})
+    sheets = pd.read_excel(io.BytesIO(workbook), sheet_name=None)
+
+    titles = [long_name[:31], f'{long_name[:25]} (2)', f'{long_name[:25]} (3)']
+    assert list(sheets) == titles + ['empty']
+    assert [len(sheets[title]) for title in titles] == [3, 3, 1]
+    assert_same_table(tables['bouts_data'], pd.concat([sheets[title] for title in titles]))
+    # an empty table still gets a sheet with its header
+    assert list(sheets['empty'].columns) == ['Subject', 'Time_start'] and sheets['empty'].empty
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_zip_round_trip(tables, file_format):
+    with zipfile.ZipFile(io.BytesIO(be.write_to_zip(tables, file_format))) as archive:
+        assert archive.namelist() == [f'{name}.{file_format}' for name in tables]
+        for name, table in tables.items():
+            with archive.open(f'{name}.{file_format}') as file:
+                member = pd.read_parquet(file) if file_format == 'parquet' else pd.read_csv(file)
+            if file_format == 'csv':
+                table = table.astype({'Subject': object})
+            assert_same_table(table, member)
+
+
+def test_zip_rejects_unknown_formats(tables):
+    with pytest.raises(ValueError, match='Unknown export format'):
+        be.write_to_zip(tables, 'json')
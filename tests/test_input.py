@@ -0,0 +1,34 @@
+import pandas as pd
+import backend as be
+from conftest import REPO_DIR
+
+TEXT_COLUMNS = ['Observation id', 'Subject', 'Behavior', 'Behavior type']
+
+
+def test_concatenated_exports_stay_categorical():
+    dfs = be.import_input_files(sorted((REPO_DIR / 'new_data').glob('*.tsv')))
+    # the exports have different ids, subjects and behaviours, so their categories differ
+    assert len({tuple(df['Observation id'].cat.categories) for df in dfs.values()}) == len(dfs)
+
+    combined = be.concat_input_tables(dfs)
+    for column in TEXT_COLUMNS:
+        assert isinstance(combined[column].dtype, pd.CategoricalDtype), column
+    pd.testing.assert_frame_equal(combined, pd.concat(dfs.values()), check_dtype=False, check_categorical=False)
+
+
+def test_cached_exports_match_parsed_ones(tmp_path):
+    paths = sorted((REPO_DIR / 'new_data').glob('*.tsv'))
+    parsed = be.import_input_files(paths)
+    be.import_input_files(paths, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('*.parquet'))) == len(paths)
+    cached = be.import_input_files(paths, cache_dir=tmp_path)
+    for name in parsed:
+        pd.testing.assert_frame_equal(cached[name], parsed[name])
+
+
+def test_parser_engines_agree():
+    path = REPO_DIR / 'new_data' / 'Sept02.tsv'
+    _, expected = be.import_input_file(path)
+    for engine in ['python', 'pyarrow']:
+        _, parsed = be.import_input_file(path, engine=engine)
+        pd.testing.assert_frame_equal(parsed, expected, check_categorical=False)
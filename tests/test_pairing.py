@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+import backend as be
+from test_pipeline import assert_same_results
+
+PAIR_COLUMNS = ['Subject', 'Behavior', 'Modifier', 'Observation date', 'Time_start', 'Time_stop']
+
+
+def get_reference_pairs(df: pd.DataFrame) -> tuple[list, list]:
+    '''
+    Pairs the k-th START with the k-th STOP of each behaviour in an
+    observation, one group at a time. Returns the pairs and the 
+    problem with each event that couldn't be paired.
+    '''
+    pairs, problems = [], []
+    for _, group in df.groupby(be.PAIRING_KEYS, observed=True, dropna=False):
+        group = group.sort_values('Time', kind='stable')
+        starts = group.loc[group['Behavior type'] == 'START', 'Time'].tolist()
+        stops = group.loc[group['Behavior type'] == 'STOP', 'Time'].tolist()
+        row = group.iloc[0]
+        for start, stop in zip(starts, stops):
+            if stop < start:
+                problems.append('negative duration')
+            else:
+                pairs.append((row['Subject'], row['Behavior'], row['Modifier'], row['Observation date'], start, stop))
+        problems += ['no STOP'] * (len(starts) - len(stops)) + ['no START'] * (len(stops) - len(starts))
+    return sorted(pairs), sorted(problems)
+
+
+def add_subject(df: pd.DataFrame, subject: str, behaviour_types: list[str]) -> pd.DataFrame:
+    # a subject with one event per behaviour type, 100 s apart, in the first observation
+    first_row = df.iloc[[0] * len(behaviour_types)]
+    rows = first_row.astype({'Subject': str, 'Behavior type': str}).assign(
+        Subject=subject, **{'Behavior type': behaviour_types, 'Time': [100.0 * (i + 1) for i in range(len(behaviour_types))]})
+    return pd.concat([df.astype({'Subject': str, 'Behavior type': str}), rows], ignore_index=True)
+
+
+def test_pairs_match_the_reference(synthetic_data):
+    data = be.get_behaviour_modifiers(synthetic_data.copy())
+    # a STOP that comes before its START
+    data.loc[data.index[0], 'Time'] = -1.0
+    paired, unmatched = be.pair_start_and_stop_events(data.sort_values('Time', kind='stable'))
+    expected_pairs, expected_problems = get_reference_pairs(data)
+    assert sorted(paired[PAIR_COLUMNS].itertuples(index=False, name=None)) == expected_pairs
+    assert sorted(unmatched['Problem']) == expected_problems
+
+
+@pytest.mark.parametrize('mode', ['serial', 'grouped', 'lazy', 'parallel', 'store'])
+def test_subjects_without_matched_events_are_kept(new_data, mode):
+    data = add_subject(new_data, 'DMO-unpaired', ['START', 'START'])
+    data = add_subject(data, 'DMO-doubled', ['START', 'START', 'STOP'])
+    if mode == 'store':
+        store = be.ObservationStore()
+        store.update(data)
+        results = store.get_results()
+    else:
+        results = be.run_pipeline(data, grouped=mode == 'grouped', lazy=mode == 'lazy', 
+                                  workers=2 if mode == 'parallel' else None)
+
+    assert list(results) == list(data['Subject'].unique())
+    assert results['DMO-unpaired']['raw_behavioural_data'].empty
+    assert list(results['DMO-unpaired']['unmatched_events']['Problem']) == ['no STOP', 'no STOP']
+    assert list(results['DMO-doubled']['unmatched_events']['Problem']) == ['no STOP']
+    for table in be.SubjectResults.TABLES:
+        results['DMO-unpaired'][table]
+    assert_same_results(be.run_pipeline(data), results)
+
+
+def test_unmatched_events_are_reported_when_nothing_is_matched(new_data):
+    data = add_subject(new_data, 'DMO-unpaired', ['START', 'START'])
+    data = data[data['Subject'] == 'DMO-unpaired']
+    for results in [be.run_pipeline(data), be.run_pipeline(data, grouped=True)]:
+        assert list(results) == ['DMO-unpaired']
+        assert len(results['DMO-unpaired']['unmatched_events']) == 2
+
+
+def get_comparable_table(df: pd.DataFrame) -> pd.DataFrame:
+    # compacted tables have the subject in the index and their columns sorted
+    if df.index.name == 'Subject':
+        df = df.reset_index()
+    return df.reset_index(drop=True).sort_index(axis=1)
+
+
+def test_unmatched_times_stay_missing(new_data):
+    data = add_subject(new_data, 'DMO-stray', ['START', 'STOP', 'STOP'])
+    results = be.run_pipeline(data, grouped=True)
+    unmatched = be.combine_subject_tables(results, 'unmatched_events').loc[['DMO-stray']]
+    assert list(unmatched['Problem']) == ['no START']
+    assert unmatched[['Time_start', 'Behaviour Duration (s)']].isna().all().all()
+
+    compacted, combined, _ = be.compact_results(results)
+    assert combined['unmatched_events'].loc[['DMO-stray'], 'Time_start'].isna().all()
+    for subject in results:
+        for table in be.EVENT_TABLES:
+            pd.testing.assert_frame_equal(get_comparable_table(compacted[subject][table]), 
+                                          get_comparable_table(results[subject][table]), check_dtype=False, 
+                                          check_categorical=False, atol=1e-4, obj=f'{subject} {table}')
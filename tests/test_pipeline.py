@@ -0,0 +1,132 @@
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+import backend as be
+
+
+def assert_same_results(expected, actual):
+    '''
+    Every mode gives the same subjects, tables and values. Dtypes
+    can differ (e.g. a categorical against an object column), and
+    unmatched events are compared in time order, since the modes 
+    find them in a different order.
+    '''
+    assert list(actual) == list(expected)
+    for subject in expected:
+        assert list(actual[subject]) == list(expected[subject])
+        for table in expected[subject]:
+            expected_table, actual_table = expected[subject][table], actual[subject][table]
+            if table == 'unmatched_events':
+                expected_table = expected_table.sort_values(['Time_start', 'Time_stop']).reset_index(drop=True)
+                actual_table = actual_table.sort_values(['Time_start', 'Time_stop']).reset_index(drop=True)
+            pd.testing.assert_frame_equal(expected_table, actual_table, check_dtype=False, 
+                                          check_categorical=False, check_index_type=False, obj=f'{subject} {table}')
+
+
+@pytest.fixture(params=['new_data', 'synthetic_data'])
+def raw_data(request):
+    return request.getfixturevalue(request.param)
+
+
+def test_grouped_matches_serial(raw_data):
+    expected = be.run_pipeline(raw_data.copy())
+    assert_same_results(expected, be.run_pipeline(raw_data.copy(), grouped=True))
+
+
+def test_parallel_matches_serial(raw_data):
+    expected = be.run_pipeline(raw_data.copy())
+    assert_same_results(expected, be.run_pipeline(raw_data.copy(), workers=2))
+
+
+@pytest.mark.parametrize('grouped', [False, True])
+def test_lazy_matches_eager(raw_data, grouped):
+    expected = be.run_pipeline(raw_data.copy(), grouped=grouped)
+    actual = be.run_pipeline(raw_data.copy(), grouped=grouped, lazy=True)
+    subject = next(iter(actual))
+    # only the events are kept up front, the rest is built when first looked up
+    assert not any(actual[subject].is_computed(table) for table in be.SubjectResults.TABLE_BUILDERS)
+    assert_same_results(expected, actual)
+    assert all(actual[subject].is_computed(table) for table in be.SubjectResults.TABLE_BUILDERS)
+
+
+def test_payload_keeps_the_columns_and_dtypes(new_data):
+    subject_data = new_data[new_data['Subject'] == new_data['Subject'].iloc[0]]
+    payload = be.get_payload(subject_data)
+    # text columns go as codes, not as one string per row
+    assert all(not isinstance(values, tuple) or values[0].dtype.kind == 'i' for values in payload.values())
+    pd.testing.assert_frame_equal(be.get_frame_from_payload(payload), subject_data.reset_index(drop=True))
+
+
+def test_store_matches_serial(raw_data):
+    expected = be.run_pipeline(raw_data.copy())
+    store = be.ObservationStore()
+    store.update(raw_data)
+    assert_same_results(expected, store.get_results())
+
+
+def test_store_only_processes_new_observations(raw_data):
+    observations = list(raw_data['Observation id'].unique())
+    store = be.ObservationStore()
+    assert store.update(raw_data[raw_data['Observation id'] == observations[0]]) == observations[:1]
+    assert store.update(raw_data) == observations[1:]
+    assert_same_results(be.run_pipeline(raw_data.copy()), store.get_results())
+
+    # dropping an observation drops its results too
+    remaining = raw_data[raw_data['Observation id'] != observations[-1]]
+    assert store.update(remaining) == []
+    assert_same_results(be.run_pipeline(remaining.copy()), store.get_results())
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_compact_results_share_the_combined_tables(new_data, lazy):
+    expected = be.run_pipeline(new_data.copy(), grouped=True)
+    results, combined, _ = be.compact_results(be.run_pipeline(new_data.copy(), grouped=True, lazy=lazy))
+    # lazy results only have their events when they're compacted, the rest are built from the compacted events
+    assert set(combined) == ({'raw_behavioural_data', 'outliers', 'unmatched_events'} if lazy 
+                             else set(be.EVENT_TABLES))
+    for table, shared in combined.items():
+        assert shared.index.dtype == 'category'
+        pd.testing.assert_frame_equal(shared, be.combine_subject_tables(expected, table), check_dtype=False, 
+                                      check_categorical=False, check_index_type=False, atol=1e-4)
+        # each subject's table is a view into the shared one
+        column = shared.select_dtypes('number').columns[0]
+        for subject in results:
+            subject_table = results[subject][table]
+            assert subject_table.empty or np.shares_memory(subject_table[column].to_numpy(), shared[column].to_numpy())
+    for table in be.SubjectResults.TABLES:
+        pd.testing.assert_frame_equal(be.combine_subject_tables(results, table), 
+                                      be.combine_subject_tables(expected, table), check_dtype=False, 
+                                      check_categorical=False, check_index_type=False, atol=1e-4)
+
+
+def test_lazy_store_only_keeps_the_events(raw_data):
+    expected = be.run_pipeline(raw_data.copy())
+    store = be.ObservationStore()
+    store.update(raw_data)
+    assert_same_results(expected, store.get_results(lazy=True))
+    # the aggregates are left until eager results are asked for, and then kept
+    assert all(set(partition) == {'bouts', 'outliers', 'unmatched'} for partition in store.partitions.values())
+    assert_same_results(expected, store.get_results())
+    assert all('bouts_data' in partition for partition in store.partitions.values())
+
+
+def test_store_update_reports_progress_and_can_be_cancelled(raw_data):
+    observations = list(raw_data['Observation id'].unique())
+    cancelled = threading.Event()
+    calls = []
+
+    def progress(done, total):
+        calls.append((done, total))
+        if done == 1:
+            cancelled.set()
+
+    store = be.ObservationStore()
+    # the update stops before its second observation
+    assert store.update(raw_data, progress, cancelled) == observations[:1]
+    assert calls == [(0, len(observations)), (1, len(observations))]
+    # and the next update carries on from there
+    calls.clear()
+    assert store.update(raw_data, lambda done, total: calls.append((done, total))) == observations[1:]
+    assert calls == [(done, len(observations)) for done in range(len(observations) + 1)]
+    assert_same_results(be.run_pipeline(raw_data.copy()), store.get_results())
@@ -0,0 +1,78 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import backend as be
+
+ARRAY_BYTES = 20_000_000
+
+
+def allocate(size):
+    # holds `size` bytes for a moment, then frees them
+    return len(np.ones(size // 8))
+
+
+def test_stages_are_plain_calls_without_a_recorder():
+    assert be.run_stage('sum', sum, [1, 2]) == 3
+
+
+def test_stages_are_recorded():
+    df = pd.DataFrame({'a': range(5)})
+    recorder = be.StageRecorder()
+    with be.instrumented(recorder):
+        be.run_stage('head', pd.DataFrame.head, df, 2, subject='DMO-1')
+        be.run_stage('head', pd.DataFrame.head, df, 3, subject='DMO-2')
+        be.run_stage('split', lambda df: (df.iloc[:1], df.iloc[1:]), df, source='Sept02')
+    # only while the recorder is active
+    be.run_stage('head', pd.DataFrame.head, df, 4)
+
+    stages = recorder.to_frame()
+    assert list(stages.columns) == be.StageRecorder.columns
+    assert stages['stage'].tolist() == ['head', 'head', 'split']
+    assert stages['subject'].tolist()[:2] == ['DMO-1', 'DMO-2']
+    assert stages['source'].tolist()[2] == 'Sept02'
+    assert stages['rows_in'].tolist() == [5, 5, 5]
+    assert stages['rows_out'].tolist() == [2, 3, 1]
+    assert stages['peak_memory_bytes'].isna().all()
+
+    summary = recorder.summary()
+    assert summary.index.tolist() == ['head', 'split']
+    assert summary['calls'].tolist() == [2, 1]
+    assert summary['rows_out'].tolist() == [5, 1]
+    assert summary.loc['head', 'wall_time_s'] == pytest.approx(stages['wall_time_s'][:2].sum())
+
+
+def test_trace_has_an_event_per_stage():
+    recorder = be.StageRecorder()
+    with be.instrumented(recorder):
+        be.run_stage('head', pd.DataFrame.head, pd.DataFrame({'a': range(5)}), 2, subject='DMO-1')
+    events = json.loads(recorder.to_trace())['traceEvents']
+    assert len(events) == 1
+    event = events[0]
+    assert (event['name'], event['ph']) == ('head', 'X')
+    assert event['dur'] == pytest.approx(recorder.records[0]['wall_time_s'] * 1e6)
+    # missing values are left out of the arguments
+    assert event['args'] == {'subject': 'DMO-1', 'rows_in': 5, 'rows_out': 2}
+
+
+def test_nested_stages_keep_the_outer_peak():
+    def outer():
+        allocate(ARRAY_BYTES)
+        # the inner stage starts after the outer one's peak, and peaks lower
+        return be.run_stage('inner', allocate, ARRAY_BYTES // 4)
+
+    recorder = be.StageRecorder(trace_memory=True)
+    with be.instrumented(recorder):
+        be.run_stage('outer', outer)
+    peaks = recorder.to_frame().set_index('stage')['peak_memory_bytes']
+    assert ARRAY_BYTES // 4 <= peaks['inner'] < ARRAY_BYTES
+    assert peaks['outer'] >= ARRAY_BYTES
+    assert not recorder._open_peaks
+
+
+def test_failed_stages_are_closed():
+    recorder = be.StageRecorder(trace_memory=True)
+    with be.instrumented(recorder):
+        with pytest.raises(ZeroDivisionError):
+            be.run_stage('divide', lambda: 1 / 0)
+    assert not recorder._open_peaks and not recorder.records
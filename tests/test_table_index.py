@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+import app
+import backend as be
+
+
+@pytest.fixture(scope='module', params=['uncompacted', 'compacted'])
+def result_tables(request, synthetic_data):
+    results = be.run_pipeline(synthetic_data.copy(), grouped=True)
+    if request.param == 'uncompacted':
+        return app.ResultTables(results)
+    results, combined, memory_report = be.compact_results(results)
+    return app.ResultTables(results, memory_report, combined)
+
+
+def get_expected_rows(table, subjects, behaviours, dates, time_range) -> np.ndarray:
+    # the same filters as a scan of every row
+    mask = np.ones(len(table), dtype=bool)
+    if app.ALL_SUBJECTS not in subjects:
+        mask &= table.index.isin(subjects)
+    if behaviours:
+        mask &= table['Behavior'].isin(behaviours).to_numpy()
+    if dates:
+        mask &= table['Observation date'].isin(dates).to_numpy()
+    if time_range is not None:
+        mask &= ((table['Time_stop'] >= time_range[0]) & (table['Time_start'] <= time_range[1])).to_numpy()
+    return np.flatnonzero(mask)
+
+
+@pytest.mark.parametrize('data_type', app.PAGED_DATA_TYPES)
+def test_find_rows_matches_a_scan(result_tables, data_type):
+    table = result_tables.get_table(data_type)
+    index = result_tables.get_index(data_type)
+    subjects = list(table.index.unique())
+    behaviours = index.get_values('Behavior')
+    dates = index.get_values('Observation date')
+    start, stop = index.get_time_bounds()
+    rng = np.random.default_rng(0)
+
+    def pick(values):
+        return list(rng.choice(values, rng.integers(0, len(values) + 1), replace=False)) if values else []
+
+    for _ in range(100):
+        selected_subjects = [app.ALL_SUBJECTS] if rng.random() < 0.2 else pick(subjects) + ['not a subject']
+        selected_behaviours, selected_dates = pick(behaviours), pick(dates)
+        time_range = None if rng.random() < 0.3 else tuple(sorted(rng.uniform(start, stop, 2)))
+        rows = result_tables.find_rows(data_type, selected_subjects, selected_behaviours, selected_dates, time_range)
+        expected = get_expected_rows(table, selected_subjects, selected_behaviours, selected_dates, time_range)
+        np.testing.assert_array_equal(rows, expected)
+
+        page_size = int(rng.choice([5, 50]))
+        page = int(rng.integers(0, max(1, -(-len(rows) // page_size))))
+        columns = ['Behavior', 'Time_start']
+        pd.testing.assert_frame_equal(result_tables.get_page(data_type, rows, page, page_size, columns),
+                                      table.iloc[expected[page * page_size:(page + 1) * page_size]][columns])
+
+
+def test_index_values_and_bounds(result_tables):
+    table = result_tables.get_table(app.RAW_BEHAVIOURAL_DATA)
+    index = result_tables.get_index(app.RAW_BEHAVIOURAL_DATA)
+    assert index.get_values('Behavior') == sorted(table['Behavior'].unique())
+    assert index.get_values('Observation date') == sorted(table['Observation date'].unique())
+    assert index.get_time_bounds() == pytest.approx((table['Time_start'].min(), table['Time_stop'].max()))
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import pytest
+import backend as be
+
+
+@pytest.fixture(scope='module')
+def events(synthetic_data):
+    # the matched events of every subject, as the tables below are built from them
+    bouts, _, _ = be.get_bouts_for_all_subjects(be.get_behaviour_modifiers(synthetic_data.copy()), be.DEFAULT_GAP)
+    return bouts
+
+
+def get_reference_time_budget(events: pd.DataFrame, bin_width: float) -> pd.DataFrame:
+    '''
+    Goes through every bin of every event's observation and
+    adds up the part of the event that falls inside it.
+    '''
+    rows = {}
+    columns = ['Subject', 'Observation id', 'Observation date', 'Behavior', 'Modifier', 
+               'Time_start', 'Time_stop', 'Observation duration']
+    for subject, observation, date, behaviour, modifier, start, stop, duration in zip(*map(events.get, columns)):
+        for bin_start in np.arange(0, max(duration, stop), bin_width):
+            seconds = min(stop, bin_start + bin_width) - max(start, bin_start)
+            if seconds > 0:
+                bin_end = min(bin_start + bin_width, max(duration, bin_start))
+                key = (subject, observation, date, bin_start, behaviour, modifier)
+                rows.setdefault(key, [bin_end, 0.0])[1] += seconds
+    time_budget = pd.DataFrame([key + tuple(value) for key, value in rows.items()], columns=[
+        'Subject', 'Observation id', 'Observation date', 'Bin start (s)', 'Behavior', 'Modifier',
+        'Bin end (s)', 'Duration in bin (s)'])
+    time_budget['Proportion of bin'] = time_budget['Duration in bin (s)'] / (
+        time_budget['Bin end (s)'] - time_budget['Bin start (s)'])
+    return time_budget
+
+
+def sort_rows(df: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    df = df.astype({column: str for column in by if df[column].dtype.kind not in 'if'})
+    return df.sort_values(by).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('bin_width', [60, be.DEFAULT_BIN_WIDTH])
+def test_time_budget_matches_the_bin_loop(events, bin_width):
+    keys = ['Subject', 'Observation id', 'Observation date', 'Bin start (s)', 'Behavior', 'Modifier']
+    actual = sort_rows(be.get_time_budget(events, bin_width), keys)
+    expected = sort_rows(get_reference_time_budget(events, bin_width), keys)[actual.columns]
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    # every second of every event is in exactly one bin
+    totals = actual.groupby('Subject')['Duration in bin (s)'].sum()
+    expected_totals = events.groupby('Subject', observed=True)['Behaviour Duration (s)'].sum()
+    np.testing.assert_allclose(totals.sort_index(), expected_totals.rename(str).sort_index())
+
+
+def test_time_budget_bin_edges():
+    # an event that stops on a bin edge stays in its bin, and the last bin ends with the observation
+    events = pd.DataFrame({
+        'Subject': ['A', 'A'], 'Observation id': ['obs', 'obs'], 'Observation date': ['day', 'day'],
+        'Behavior': ['BR', 'BR'], 'Modifier': ['A', 'A'], 'Observation duration': [250., 250.],
+        'Time_start': [50., 180.], 'Time_stop': [100., 240.],
+    })
+    time_budget = be.get_time_budget(events, 100)
+    assert time_budget['Bin start (s)'].tolist() == [0., 100., 200.]
+    assert time_budget['Bin end (s)'].tolist() == [100., 200., 250.]
+    assert time_budget['Duration in bin (s)'].tolist() == [50., 20., 40.]
+    assert time_budget['Proportion of bin'].tolist() == [0.5, 0.2, 0.8]
+
+
+def get_reference_synchrony(events: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Cuts each observation and behaviour at every event start and
+    stop, and counts which subjects have an event covering each piece.
+    '''
+    pairs, groups = [], []
+    for (observation, date, behaviour), group in events.groupby(be.SYNCHRONY_KEYS, observed=True):
+        times = np.unique(np.concatenate([group['Time_start'], group['Time_stop']]))
+        pair_overlaps = {}
+        time_any = time_together = subject_time = 0.0
+        for segment_start, segment_stop in zip(times[:-1], times[1:]):
+            covering = group[(group['Time_start'] <= segment_start) & (group['Time_stop'] >= segment_stop)]
+            subjects = sorted(set(map(str, covering['Subject'])))
+            length = segment_stop - segment_start
+            time_any += length * (len(subjects) >= 1)
+            time_together += length * (len(subjects) >= 2)
+            subject_time += length * len(subjects)
+            for i, subject_a in enumerate(subjects):
+                for subject_b in subjects[i + 1:]:
+                    pair_overlaps[subject_a, subject_b] = pair_overlaps.get((subject_a, subject_b), 0) + length
+        pairs += [(observation, date, behaviour, a, b, overlap) for (a, b), overlap in pair_overlaps.items()]
+        groups.append((observation, date, behaviour, group['Subject'].nunique(), time_any, time_together,
+                       time_together / time_any, subject_time / time_any))
+    pairs = pd.DataFrame(pairs, columns=be.SYNCHRONY_KEYS + ['Subject A', 'Subject B', 'Overlap (s)'])
+    groups = pd.DataFrame(groups, columns=be.SYNCHRONY_KEYS + [
+        'Subjects', 'Time any (s)', 'Time together (s)', 'Synchrony index', 'Mean subjects at once'])
+    return pairs, groups
+
+
+def test_synchrony_matches_the_segment_count(events):
+    pairs, groups = be.get_synchrony(events)
+    expected_pairs, expected_groups = get_reference_synchrony(events)
+    assert len(expected_pairs) and len(expected_groups)
+
+    pair_keys = be.SYNCHRONY_KEYS + ['Subject A', 'Subject B']
+    pd.testing.assert_frame_equal(sort_rows(pairs, pair_keys), sort_rows(expected_pairs, pair_keys), 
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(sort_rows(groups, be.SYNCHRONY_KEYS), 
+                                  sort_rows(expected_groups, be.SYNCHRONY_KEYS), check_dtype=False)
+
+
+@pytest.mark.parametrize('raw_data_name', ['new_data', 'synthetic_data'])
+def test_gap_sensitivity_matches_a_run_per_gap(request, raw_data_name):
+    raw_data = request.getfixturevalue(raw_data_name)
+    gaps = [0, 1, 5, be.DEFAULT_GAP, 30, 60]
+    bouts, _, _ = be.get_bouts_for_all_subjects(be.get_behaviour_modifiers(raw_data.copy()), be.DEFAULT_GAP)
+    sweep = be.get_gap_sensitivity(bouts, gaps).set_index(['Subject', 'Gap (s)'])
+
+    for gap in gaps:
+        results = be.run_pipeline(raw_data.copy(), grouped=True, gap=gap)
+        subjects_with_bouts = [subject for subject in results if not results[subject]['bouts_data'].empty]
+        assert sorted(sweep.xs(gap, level='Gap (s)').index) == sorted(subjects_with_bouts)
+        for subject, tables in results.items():
+            bouts_data = tables['bouts_data']
+            if bouts_data.empty:
+                continue
+            row = sweep.loc[(subject, gap)]
+            assert row['Bouts'] == len(bouts_data)
+            assert row['Mixed bouts'] == (bouts_data['mixed_bout'] == 'Mixed').sum()
+            assert row['Mean bout duration (s)'] == pytest.approx(bouts_data['Bout Duration (s)'].mean())
+            assert row['Mixed proportion'] == pytest.approx(tables['bout_statistics']['mixed_proportion'].iloc[0])
+
+
+def get_reference_interbout_statistics(events: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Walks through each subject's bouts date by date, in time order,
+    and collects the time from the end of each bout to the start of 
+    the next one.
+    '''
+    rows = {}
+    for subject, subject_events in events.groupby('Subject', observed=True, sort=False):
+        intervals = []
+        for _, date_events in subject_events.groupby('Observation date', observed=True, sort=False):
+            bouts = date_events.groupby('bout_id').agg(start=('Time_start', 'min'), stop=('Time_stop', 'max'))
+            bouts = bouts.sort_values('start')
+            intervals += list(bouts['start'].to_numpy()[1:] - bouts['stop'].to_numpy()[:-1])
+        intervals = pd.Series(intervals, dtype=float)
+        rows[subject] = {'interbout_count': len(intervals), 'interbout_sum': intervals.sum(),
+                         'interbout_mean': intervals.mean(), 'interbout_var': intervals.var(),
+                         'interbout_std': intervals.std(), 'interbout_cv': intervals.std() / intervals.mean()}
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis('Subject')
+
+
+def test_interbout_statistics_match_the_bout_loop(events):
+    actual = be.get_interbout_statistics(events)
+    expected = get_reference_interbout_statistics(events)
+    pd.testing.assert_frame_equal(actual.set_axis(actual.index.astype(str)), expected[actual.columns], 
+                                  check_dtype=False)
+
+
+def test_interbout_intervals_stay_within_a_date():
+    # A has two bouts on d1 and one on d2, B only has one bout
+    events = pd.DataFrame({
+        'Subject': ['A', 'A', 'A', 'A', 'B'], 'Observation date': ['d1', 'd1', 'd1', 'd2', 'd1'],
+        'bout_id': [1., 1., 2., 3., 1.], 'Time_start': [0., 5., 20., 0., 0.], 'Time_stop': [10., 12., 30., 5., 4.],
+    })
+    intervals = be.get_interbout_intervals(events)
+    assert intervals['Interbout Duration (s)'].tolist() == [8.]
+    statistics = be.get_interbout_statistics(events)
+    assert statistics['interbout_count'].tolist() == [1, 0]
+    # B's mean, std and cv stay missing rather than reading as 0 s
+    combined = be.combine_subject_tables({subject: {'interbout_statistics': statistics.loc[[subject]]} 
+                                          for subject in statistics.index}, 'interbout_statistics')
+    assert combined.loc['B', ['interbout_mean', 'interbout_std', 'interbout_cv']].isna().all()
+    assert combined.loc['A', 'interbout_mean'] == 8.